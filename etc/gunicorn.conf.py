@@ -0,0 +1,31 @@
+"""gunicorn settings, used by etc/systemd/system/teknologkoren-se.service.
+
+The app is preloaded in the master and the workers are forked from it,
+see teknologkoren_se/prefork.py. As the master has the code loaded,
+deploying new code requires a restart, a reload (HUP) only replaces
+the workers with new forks of the old code.
+
+etc/systemd/system/teknologkoren-se-gthread.service uses these
+settings with threaded workers instead, for many slow clients. A sync
+worker is tied up by one client until the whole request has been
+received and the response sent. Slow mobile clients, feed pollers and
+streamed pages (which nginx does not buffer) can then occupy every
+worker. gthread workers serve a request per thread and keep idle
+keep-alive connections out of the threads. The views mostly wait for
+SQLite and rendering releases the GIL often enough, so a few threaded
+workers handle far more concurrent clients than the same number of
+processes. Compare with `python manage.py benchmark slow_clients`.
+"""
+bind = 'unix:/run/teknologkoren-se/teknologkoren-se.sock'
+workers = 5
+preload_app = True
+
+
+def when_ready(server):
+    from teknologkoren_se import prefork
+    prefork.preload()
+
+
+def post_fork(server, worker):
+    from teknologkoren_se import prefork
+    prefork.after_fork()
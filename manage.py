@@ -1,9 +1,15 @@
+import time
 from flask_script import Manager, prompt, prompt_pass
 
+from flask import url_for
 from teknologkoren_se import app, db
-from teknologkoren_se.models import Tag, User
+from teknologkoren_se.database import PRIMARY_ENVIRON_KEY
+from teknologkoren_se.benchmarks import manager as benchmark_manager
+from teknologkoren_se.profiler import report as profile_report_for
+from teknologkoren_se.warmer import pages_to_warm, warm as warm_pages
 
 manager = Manager(app)
+manager.add_command('benchmark', benchmark_manager)
 
 
 @manager.command
@@ -20,5 +26,75 @@ def full_setup():
     print('Done, setup complete.')
 
 
+@manager.command
+def replica_routing():
+    """Show which database the pages and the api read from."""
+    requests = [
+        ('GET', url_for('blog.index', lang_code='sv'), {}),
+        ('GET', url_for('api.get_posts'), {}),
+        ('POST', url_for('api.get_posts'), {}),
+        ('GET', url_for('blog.index', lang_code='sv'),
+         {PRIMARY_ENVIRON_KEY: True}),
+    ]
+
+    for method, path, environ in requests:
+        with app.test_request_context(path, method=method,
+                                      environ_base=environ):
+            engine = db.session.get_bind()
+            print('{:<4} {:<14} {}{}'.format(
+                method, path, repr(engine.url),
+                ' (from the app)' if environ else ''))
+            db.session.remove()
+
+
+@manager.option('-n', '--latest', type=int, default=None,
+                help="Number of newest posts and events to warm")
+@manager.option('-c', '--concurrency', type=int, default=None,
+                help="Number of pages to request at a time")
+def warm(latest, concurrency):
+    """Warm the caches by requesting the most visited pages."""
+    start = time.perf_counter()
+    results = warm_pages(pages_to_warm(latest), concurrency)
+    total = time.perf_counter() - start
+
+    for result in results:
+        print('{:>4} {:>8.1f} ms  {}'.format(result.status,
+                                              result.seconds * 1000,
+                                              result.path))
+
+    failed = sum(result.status != 200 for result in results)
+    print('Warmed {} pages in {:.2f} s, {} failed.'.format(
+        len(results), total, failed))
+
+
+@manager.option('-d', '--directory', default=None,
+                help="Directory of the profiles, default PROFILE_DIR")
+@manager.option('-n', '--top', type=int, default=15,
+                help="Number of functions to show per endpoint")
+@manager.option('-s', '--sort', choices=('tottime', 'cumtime'),
+                default='tottime',
+                help="Time in the function itself, or including calls")
+@manager.option('-e', '--endpoint', default=None,
+                help="Only this endpoint, e.g. blog.index")
+def profile_report(directory, top, sort, endpoint):
+    """Show the hottest functions per endpoint in the saved profiles."""
+    directory = directory or app.config['PROFILE_DIR']
+
+    for report in profile_report_for(directory, top, sort, endpoint):
+        print('{} ({} requests, {:.1f} ms per request)'.format(
+            report.endpoint, report.requests, report.seconds * 1000))
+        # Per request, averaged over the profiled requests.
+        print('{:>9} {:>12} {:>12}  {}'.format(
+            'calls', 'tottime ms', 'cumtime ms', 'function'))
+
+        for function in report.functions:
+            print('{:>9.0f} {:>12.2f} {:>12.2f}  {}'.format(
+                function.calls / report.requests,
+                function.tottime * 1000 / report.requests,
+                function.cumtime * 1000 / report.requests,
+                function.function))
+        print()
+
+
 if __name__ == "__main__":
     manager.run()
@@ -0,0 +1,62 @@
+"""Add stored excerpts to posts
+
+Revision ID: 3b8d1e6f4a27
+Revises: 7a3f5c8e2b91
+Create Date: 2026-10-19 20:05:44.291736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from teknologkoren_se.excerpts import make_excerpt
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8d1e6f4a27'
+down_revision = '7a3f5c8e2b91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('excerpt_sv', sa.Text(),
+                                      nullable=True))
+        batch_op.add_column(sa.Column('excerpt_en', sa.Text(),
+                                      nullable=True))
+        batch_op.add_column(sa.Column('excerpt_more_sv', sa.Boolean(),
+                                      nullable=True))
+        batch_op.add_column(sa.Column('excerpt_more_en', sa.Boolean(),
+                                      nullable=True))
+
+    post = sa.table('post',
+                    sa.column('id', sa.Integer),
+                    sa.column('content_sv', sa.Text),
+                    sa.column('content_en', sa.Text),
+                    sa.column('excerpt_sv', sa.Text),
+                    sa.column('excerpt_en', sa.Text),
+                    sa.column('excerpt_more_sv', sa.Boolean),
+                    sa.column('excerpt_more_en', sa.Boolean))
+
+    conn = op.get_bind()
+    rows = conn.execute(sa.select([post.c.id,
+                                   post.c.content_sv,
+                                   post.c.content_en])).fetchall()
+
+    for post_id, content_sv, content_en in rows:
+        values = {}
+        for lang, content in (('sv', content_sv), ('en', content_en)):
+            html, more = make_excerpt(content) if content else (None, False)
+            values['excerpt_' + lang] = html
+            values['excerpt_more_' + lang] = more
+
+        conn.execute(post.update()
+                     .where(post.c.id == post_id)
+                     .values(**values))
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('excerpt_more_en')
+        batch_op.drop_column('excerpt_more_sv')
+        batch_op.drop_column('excerpt_en')
+        batch_op.drop_column('excerpt_sv')
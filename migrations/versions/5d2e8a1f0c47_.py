@@ -0,0 +1,60 @@
+"""Add formatted phone number to contacts
+
+Revision ID: 5d2e8a1f0c47
+Revises: b331923cc85b
+Create Date: 2026-10-19 10:12:31.482913
+
+"""
+from alembic import op
+import phonenumbers
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8a1f0c47'
+down_revision = 'b331923cc85b'
+branch_labels = None
+depends_on = None
+
+
+def format_phone(phone):
+    """Return formatted number or None, see models.format_phone."""
+    try:
+        parsed = phonenumbers.parse(phone, 'SE')
+    except phonenumbers.phonenumberutil.NumberParseException:
+        return None
+
+    if not (phonenumbers.is_possible_number(parsed) and
+            phonenumbers.is_valid_number(parsed)):
+        return None
+
+    return phonenumbers.format_number(
+        parsed,
+        phonenumbers.PhoneNumberFormat.INTERNATIONAL
+    )
+
+
+def upgrade():
+    with op.batch_alter_table('contact', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('formatted_phone',
+                                      sa.String(length=30),
+                                      nullable=True))
+
+    contact = sa.table('contact',
+                       sa.column('id', sa.Integer),
+                       sa.column('phone', sa.String),
+                       sa.column('formatted_phone', sa.String))
+
+    conn = op.get_bind()
+    rows = conn.execute(sa.select([contact.c.id, contact.c.phone])
+                        .where(contact.c.phone != None)).fetchall()
+
+    for contact_id, phone in rows:
+        conn.execute(contact.update()
+                     .where(contact.c.id == contact_id)
+                     .values(formatted_phone=format_phone(phone)))
+
+
+def downgrade():
+    with op.batch_alter_table('contact', schema=None) as batch_op:
+        batch_op.drop_column('formatted_phone')
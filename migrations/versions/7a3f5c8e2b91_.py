@@ -0,0 +1,64 @@
+"""Add updated_at to posts and a change log for incremental sync
+
+Revision ID: 7a3f5c8e2b91
+Revises: e4b7c9a2d1f3
+Create Date: 2026-10-19 19:42:57.630184
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3f5c8e2b91'
+down_revision = 'e4b7c9a2d1f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(),
+                                      nullable=True))
+
+    change = op.create_table('change',
+                             sa.Column('id', sa.Integer(), nullable=False),
+                             sa.Column('type', sa.String(length=50),
+                                       nullable=False),
+                             sa.Column('object_id', sa.Integer(),
+                                       nullable=False),
+                             sa.Column('deleted', sa.Boolean(),
+                                       nullable=False),
+                             sa.Column('changed_at', sa.DateTime(),
+                                       nullable=False),
+                             sa.PrimaryKeyConstraint('id'),
+                             sa.UniqueConstraint('type', 'object_id'),
+                             sqlite_autoincrement=True)
+
+    # Existing posts are all changes since cursor 0, oldest first.
+    post = sa.table('post',
+                    sa.column('id', sa.Integer),
+                    sa.column('type', sa.String),
+                    sa.column('timestamp', sa.DateTime),
+                    sa.column('updated_at', sa.DateTime))
+
+    conn = op.get_bind()
+    conn.execute(post.update().values(updated_at=post.c.timestamp))
+
+    rows = conn.execute(sa.select([post.c.id, post.c.type, post.c.timestamp])
+                        .order_by(post.c.timestamp, post.c.id)).fetchall()
+    if rows:
+        op.bulk_insert(change, [{
+            'type': post_type,
+            'object_id': post_id,
+            'deleted': False,
+            'changed_at': timestamp or datetime.utcnow(),
+        } for post_id, post_type, timestamp in rows])
+
+
+def downgrade():
+    op.drop_table('change')
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,72 @@
+"""Add full-text search indices for posts
+
+Revision ID: 9c61f3d2b8a4
+Revises: 5d2e8a1f0c47
+Create Date: 2026-10-19 13:40:05.117342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c61f3d2b8a4'
+down_revision = '5d2e8a1f0c47'
+branch_labels = None
+depends_on = None
+
+TOKENIZERS = {
+    'sv': 'unicode61 remove_diacritics 0',
+    'en': 'porter unicode61',
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        # FTS5 is SQLite only, search falls back to LIKE elsewhere.
+        return
+
+    for lang, tokenize in TOKENIZERS.items():
+        table = 'post_fts_{}'.format(lang)
+        columns = 'title, content_{0}, readmore_{0}'.format(lang)
+        new = 'new.id, new.title, new.content_{0}, new.readmore_{0}'.format(
+            lang)
+        old = 'old.id, old.title, old.content_{0}, old.readmore_{0}'.format(
+            lang)
+
+        op.execute(
+            "CREATE VIRTUAL TABLE {table} USING fts5({columns}, "
+            "content='post', content_rowid='id', tokenize='{tokenize}')"
+            .format(table=table, columns=columns, tokenize=tokenize))
+
+        op.execute(
+            "CREATE TRIGGER {table}_ai AFTER INSERT ON post BEGIN "
+            "INSERT INTO {table}(rowid, {columns}) VALUES ({new}); END"
+            .format(table=table, columns=columns, new=new))
+
+        op.execute(
+            "CREATE TRIGGER {table}_ad AFTER DELETE ON post BEGIN "
+            "INSERT INTO {table}({table}, rowid, {columns}) "
+            "VALUES ('delete', {old}); END"
+            .format(table=table, columns=columns, old=old))
+
+        op.execute(
+            "CREATE TRIGGER {table}_au AFTER UPDATE ON post BEGIN "
+            "INSERT INTO {table}({table}, rowid, {columns}) "
+            "VALUES ('delete', {old}); "
+            "INSERT INTO {table}(rowid, {columns}) VALUES ({new}); END"
+            .format(table=table, columns=columns, old=old, new=new))
+
+        # Index the existing posts
+        op.execute("INSERT INTO {0}({0}) VALUES ('rebuild')".format(table))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for lang in TOKENIZERS:
+        table = 'post_fts_{}'.format(lang)
+        for suffix in ('ai', 'ad', 'au'):
+            op.execute('DROP TRIGGER {}_{}'.format(table, suffix))
+        op.execute('DROP TABLE {}'.format(table))
@@ -0,0 +1,31 @@
+"""Add content hashes of uploaded images
+
+Revision ID: e4b7c9a2d1f3
+Revises: 9c61f3d2b8a4
+Create Date: 2026-10-19 19:30:12.118406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c9a2d1f3'
+down_revision = '9c61f3d2b8a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('image',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('filename', sa.String(length=255),
+                              nullable=False),
+                    sa.Column('sha256', sa.String(length=64), nullable=False),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('filename'),
+                    sa.UniqueConstraint('sha256'))
+
+
+def downgrade():
+    op.drop_table('image')
@@ -1,9 +1,11 @@
-from flask import Flask, abort, g, request, redirect, session, url_for
+import os
+from flask import Flask, g, request, redirect, session, url_for, \
+        _request_ctx_stack
 from flask_httpauth import HTTPBasicAuth
 from flask_uploads import configure_uploads, IMAGES, UploadSet
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_cors import CORS
+from teknologkoren_se.database import Database
 
 
 class ReverseProxied:
@@ -44,32 +46,32 @@ def init_views(app):
             events,
             errors,
             general,
+            resize,
+            sitemap,
             )
 
     app.register_blueprint(api.mod)
     app.register_blueprint(blog.mod)
     app.register_blueprint(events.mod)
     app.register_blueprint(general.mod)
+    app.register_blueprint(resize.mod)
+    app.register_blueprint(sitemap.mod)
 
+    # Hooks acting on committed writes, e.g. invalidating caches.
+    from teknologkoren_se import publish
 
-def catch_image_resize(image_size, image):
-    """Redirect requests to resized images.
+    # Records changes to posts and events for /api/changes.
+    from teknologkoren_se import changes
 
-    Flask's built-in server does not understand the image resize
-    path argument that nginx uses. This redirects those urls to the
-    original images.
-    """
-    if request.endpoint == 'image_resize':
-        non_resized_url = '/static/images/{}'
-    elif request.endpoint == 'upload_resize':
-        non_resized_url = '/static/uploads/images/{}'
-    else:
-        # Why are we in this function?
-        abort(500)
+    from teknologkoren_se import ratelimit
+
+    # Streaming image uploads, sets app.request_class.
+    from teknologkoren_se import uploads
 
-    non_resized_url = non_resized_url.format(image)
+    # Profiles requests on demand, wraps app.wsgi_app.
+    from teknologkoren_se import profiler
 
-    return redirect(non_resized_url)
+    from teknologkoren_se import request_log
 
 
 def setup_flask_assets(app):
@@ -145,6 +147,21 @@ def setup_babel(app):
         # The new path matches a view! We redirect there.
         return redirect(new_path)
 
+    # Flask-Babel reads the catalog from disk for every request, keep
+    # them in memory instead. Preloaded, they are shared by all workers.
+    catalogs = {}
+
+    @app.before_request
+    def reuse_translations():
+        if request.endpoint == 'static':
+            return
+
+        locale = str(flask_babel.get_locale())
+        if locale not in catalogs:
+            catalogs[locale] = flask_babel.get_translations()
+
+        _request_ctx_stack.top.babel_translations = catalogs[locale]
+
     def url_for_lang(endpoint,
                      lang_code,
                      view_args,
@@ -171,6 +188,44 @@ def setup_babel(app):
 
 app = Flask(__name__)
 app.config.from_object('config')
+app.config.setdefault('CACHE_DIR', os.path.join(app.instance_path, 'cache'))
+app.config.setdefault('STREAM_TEMPLATES', True)
+app.config.setdefault('STREAM_BUFFER_SIZE', 8192)
+app.config.setdefault('CACHE_PURGE_URL', None)
+app.config.setdefault('TASKS_SYNCHRONOUS', False)
+app.config.setdefault('TASKS_WORKERS', 2)
+app.config.setdefault('TASKS_QUEUE_SIZE', 100)
+app.config.setdefault('TASKS_RETRIES', 3)
+app.config.setdefault('TASKS_RETRY_DELAY', 1.0)
+app.config.setdefault('TASKS_DEAD_LETTER_LOG',
+                      os.path.join(app.config['CACHE_DIR'], 'dead_letter.log'))
+app.config.setdefault('WEBSUB_HUBS', [])
+# Flask defaults to None, no limit at all on streamed uploads.
+if app.config['MAX_CONTENT_LENGTH'] is None:
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config.setdefault('CACHE_WARM_AFTER_WRITES', True)
+app.config.setdefault('CACHE_WARM_LATEST', 5)
+app.config.setdefault('CACHE_WARM_CONCURRENCY', 4)
+app.config.setdefault('RATELIMITS', {})
+app.config.setdefault('RATELIMIT_STORAGE', 'memory')
+app.config.setdefault('RATELIMIT_ARCHIVE_DEPTH', 5)
+app.config.setdefault('PROFILE_DIR',
+                      os.path.join(app.instance_path, 'profiles'))
+app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+app.config.setdefault('REQUEST_LOGGING', True)
+app.config.setdefault('REQUEST_LOG', None)
+app.config.setdefault('REQUEST_LOG_SLOW', 0.5)
+app.config.setdefault('IMAGE_WIDTHS', (200, 400, 600, 800, 1200, 1600))
+app.config.setdefault('IMAGE_CACHE_DIR',
+                      os.path.join(app.config['CACHE_DIR'], 'images'))
+app.config.setdefault('IMAGE_CACHE_SIZE', 512 * 1024 * 1024)
+app.config.setdefault('IMAGE_JPEG_QUALITY', 85)
+app.config.setdefault('BILLETTO_WIDGET_URL',
+                      'https://billetto.se/e/{}/widget_new?theme=white')
+app.config.setdefault('WIDGET_TTL', 300)
+app.config.setdefault('WIDGET_MAX_STALE', 86400)
+app.config.setdefault('WIDGET_ERROR_TTL', 60)
+app.config.setdefault('WIDGET_CACHE_SIZE', 256)
 
 app.wsgi_app = ReverseProxied(app.wsgi_app)
 
@@ -181,7 +236,7 @@ token_auth = HTTPBasicAuth()
 
 CORS(app)
 
-db = SQLAlchemy(app)
+db = Database(app)
 migrate = Migrate(app, db)
 
 images = UploadSet('images', IMAGES)
@@ -192,14 +247,3 @@ assets = setup_flask_assets(app)
 babel = setup_babel(app)
 
 init_views(app)  # last, views might import stuff from this file
-
-if app.debug:
-    # If in debug mode, add rule for resized image paths to go through
-    # the redirection function.
-    app.add_url_rule('/static/images/<image_size>/<image>',
-                     endpoint='image_resize',
-                     view_func=catch_image_resize)
-
-    app.add_url_rule('/static/uploads/images/<image_size>/<image>',
-                     endpoint='upload_resize',
-                     view_func=catch_image_resize)
@@ -0,0 +1,531 @@
+"""Benchmarks, run with `python manage.py benchmark <name>`.
+
+Most benchmarks run against a temporary database seeded with fake
+content, the configured database is never touched. `memory` and
+`slow_clients` measure a running server instead.
+"""
+import base64
+import contextlib
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from flask_script import Manager
+from werkzeug.security import generate_password_hash
+from teknologkoren_se import app, db
+from teknologkoren_se.models import Post, Event
+
+manager = Manager(usage="Run benchmarks against a temporary database")
+
+LOREM = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do "
+         "eiusmod tempor incididunt ut labore et dolore magna aliqua. ")
+
+
+@contextlib.contextmanager
+def temporary_database(**config):
+    """Point the app to an empty SQLite database for the duration.
+
+    Keyword arguments temporarily override config values.
+    """
+    directory = tempfile.mkdtemp()
+    # The benchmarks would only measure the rate limits, or the
+    # warming after every write. The request log would fill the output.
+    config.setdefault('RATELIMITS', {})
+    config.setdefault('CACHE_WARM_AFTER_WRITES', False)
+    config.setdefault('REQUEST_LOGGING', False)
+    config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(
+        directory, 'benchmark.db')
+    old_config = {key: app.config.get(key) for key in config}
+    app.config.update(config)
+
+    try:
+        with app.app_context():
+            db.create_all()
+        yield
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.get_engine(app).dispose()
+        app.config.update(old_config)
+        shutil.rmtree(directory)
+
+
+def seed(posts=50, events=20, paragraphs=5):
+    """Add published posts and events with a few paragraphs each."""
+    now = datetime.utcnow()
+    content = '\n\n'.join([LOREM * 3] * paragraphs)
+
+    with app.app_context():
+        for i in range(posts):
+            db.session.add(Post(title='Post {}'.format(i),
+                                content_sv=content,
+                                content_en=content,
+                                readmore_sv=content,
+                                published=True,
+                                timestamp=now - timedelta(days=i)))
+        for i in range(events):
+            db.session.add(Event(title='Konsert {}'.format(i),
+                                 content_sv=content,
+                                 content_en=content,
+                                 published=True,
+                                 timestamp=now - timedelta(days=i, hours=1),
+                                 start_time=now + timedelta(days=i - 10),
+                                 location='Kårhuset'))
+        db.session.commit()
+
+
+def api_headers():
+    """Add a temporary api user and return headers authenticating as it."""
+    password = base64.b64encode(os.urandom(12)).decode()
+    app.config['USERS'] = dict(app.config['USERS'],
+                               benchmark=generate_password_hash(password))
+    credentials = base64.b64encode(
+        'benchmark:{}'.format(password).encode()).decode()
+
+    return {'Authorization': 'Basic ' + credentials,
+            'Content-Type': 'application/json'}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(label, seconds, latencies, errors=0):
+    print('{:<24} {:>8.1f} req/s  p50 {:>7.2f} ms  p95 {:>7.2f} ms  '
+          'errors {}'.format(label,
+                             len(latencies) / seconds,
+                             percentile(latencies, 0.5) * 1000,
+                             percentile(latencies, 0.95) * 1000,
+                             errors))
+
+
+def hammer(path, seconds, threads, headers=None, method='GET', data=None):
+    """Request `path` from `threads` threads for `seconds` seconds.
+
+    Returns a list of request latencies and the number of responses
+    that were not 2xx.
+    """
+    stop = threading.Event()
+    latencies = []
+    errors = []
+
+    def work():
+        client = app.test_client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = client.open(path, method=method, headers=headers,
+                                   data=data)
+            latencies.append(time.perf_counter() - start)
+            if not 200 <= response.status_code < 300:
+                errors.append(response.status_code)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+
+    time.sleep(seconds)
+    stop.set()
+
+    for worker in workers:
+        worker.join()
+
+    return latencies, len(errors)
+
+
+@manager.option('-s', '--seconds', dest='seconds', type=float, default=5.0)
+@manager.option('-r', '--readers', dest='readers', type=int, default=4)
+@manager.option('-w', '--writers', dest='writers', type=int, default=1)
+def reads(seconds, readers, writers):
+    """Read throughput of blog.index during concurrent api writes.
+
+    Runs once with SQLite's default pragmas (rollback journal) and once
+    with the configured pragmas.
+    """
+    defaults = {key: None for key in ('SQLITE_SYNCHRONOUS',
+                                      'SQLITE_MMAP_SIZE',
+                                      'SQLITE_CACHE_SIZE',
+                                      'SQLITE_TEMP_STORE')}
+    defaults['SQLITE_JOURNAL_MODE'] = 'DELETE'
+
+    post = json.dumps({
+        'title': 'Benchmark',
+        'content_sv': LOREM,
+        'content_en': LOREM,
+        'readmore_sv': None,
+        'readmore_en': None,
+        'published': True,
+        'image': None,
+    })
+
+    for label, config in (('default pragmas', defaults),
+                          ('configured pragmas', {})):
+        with temporary_database(**config):
+            seed()
+            headers = api_headers()
+
+            results = {}
+
+            def write():
+                results['writes'] = hammer('/api/posts', seconds, writers,
+                                           headers=headers, method='POST',
+                                           data=post)
+
+            writer = threading.Thread(target=write)
+            writer.start()
+            results['reads'] = hammer('/sv/', seconds, readers)
+            writer.join()
+
+        report(label + ' reads', seconds, *results['reads'])
+        report(label + ' writes', seconds, *results['writes'])
+
+
+@manager.option('-n', '--requests', dest='requests', type=int, default=200)
+@manager.option('-p', '--paragraphs', dest='paragraphs', type=int, default=30)
+def ttfb(requests, paragraphs):
+    """Time to first byte of the overview pages, buffered vs streamed.
+
+    Posts are seeded with `paragraphs` paragraphs each, long concert
+    write-ups are what makes the pages slow to render.
+    """
+    paths = ('/sv/', '/sv/konserter/', '/sv/konserter/arkiv/')
+
+    with temporary_database():
+        seed(paragraphs=paragraphs)
+
+        for streamed in (False, True):
+            app.config['STREAM_TEMPLATES'] = streamed
+            client = app.test_client()
+
+            for path in paths:
+                first_bytes = []
+                totals = []
+
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    response = client.get(path, buffered=False)
+                    body = iter(response.response)
+                    next(body)
+                    first_bytes.append(time.perf_counter() - start)
+                    for _ in body:
+                        pass
+                    totals.append(time.perf_counter() - start)
+                    response.close()
+
+                print('{:<10} {:<24} first byte p50 {:>6.2f} ms  '
+                      'complete p50 {:>6.2f} ms'.format(
+                          'streamed' if streamed else 'buffered',
+                          path,
+                          percentile(first_bytes, 0.5) * 1000,
+                          percentile(totals, 0.5) * 1000))
+
+    app.config['STREAM_TEMPLATES'] = True
+
+
+@manager.option('-n', '--posts', dest='posts', type=int, default=10000)
+@manager.option('-r', '--rounds', dest='rounds', type=int, default=5)
+def serialization(posts, rounds):
+    """Serialization throughput of api responses with `posts` posts.
+
+    Compares the old path, Flask's json encoder as used by jsonify(),
+    with the encoders in serializers.py that are installed.
+    """
+    from flask import json as flask_json
+    from teknologkoren_se import serializers
+    from teknologkoren_se.views.api import make_post_dict
+
+    now = datetime.utcnow()
+    content = '\n\n'.join([LOREM * 3] * 5)
+    objects = []
+    for i in range(posts):
+        cls = Event if i % 4 == 0 else Post
+        obj = cls(id=i, title='Post {}'.format(i), content_sv=content,
+                  content_en=content, published=True,
+                  timestamp=now - timedelta(hours=i))
+        if cls is Event:
+            obj.start_time = now + timedelta(days=i)
+            obj.location = 'Kårhuset'
+        objects.append(obj)
+
+    encoders = [('flask json (jsonify)', flask_json.dumps),
+                ('stdlib json', lambda data: json.dumps(
+                    data, default=serializers.default,
+                    separators=(',', ':')))]
+    if serializers.orjson is not None:
+        encoders.append(('orjson', serializers.dumps_json))
+    if serializers.msgpack is not None:
+        encoders.append(('msgpack', serializers.dumps_msgpack))
+
+    with app.test_request_context('/api/posts'):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            data = [make_post_dict(obj) for obj in objects]
+        to_dict = (time.perf_counter() - start) / rounds
+        print('{:<24} {:>8.1f} ms'.format('to_dict', to_dict * 1000))
+
+        for label, encode in encoders:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                body = encode(data)
+            seconds = (time.perf_counter() - start) / rounds
+            print('{:<24} {:>8.1f} ms  {:>10.0f} posts/s  {:>8.1f} KiB'
+                  .format(label, seconds * 1000, posts / seconds,
+                          len(body) / 1024))
+
+
+
+@manager.option('-n', '--requests', dest='requests', type=int, default=100)
+@manager.option('-p', '--paragraphs', dest='paragraphs', type=int, default=30)
+def excerpts(requests, paragraphs):
+    """Size and render time of the overview pages, excerpts vs full text.
+
+    Posts are seeded with `paragraphs` paragraphs each. Without their
+    excerpts, the overview pages render the full text as before.
+    """
+    paths = ('/sv/', '/sv/konserter/', '/sv/konserter/arkiv/')
+
+    with temporary_database():
+        seed(paragraphs=paragraphs)
+
+        for label in ('excerpts', 'full text'):
+            if label == 'full text':
+                with app.app_context():
+                    Post.query.update({'excerpt_sv': None,
+                                       'excerpt_en': None})
+                    db.session.commit()
+
+            client = app.test_client()
+            for path in paths:
+                times = []
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    size = len(client.get(path).get_data())
+                    times.append(time.perf_counter() - start)
+
+                print('{:<10} {:<24} {:>8.1f} KiB  p50 {:>6.2f} ms'.format(
+                    label, path, size / 1024,
+                    percentile(times, 0.5) * 1000))
+
+
+@manager.option('-n', '--rounds', dest='rounds', type=int, default=200)
+@manager.option('-s', '--page-size', dest='page_size', type=int, default=5)
+@manager.option('-p', '--paragraphs', dest='paragraphs', type=int, default=30)
+def projections(rounds, page_size, paragraphs):
+    """Time and memory per overview page, ORM objects vs projections.
+
+    Loads pages of `page_size` posts and events and reads what the
+    overview templates show of them, as Post and Event objects and as
+    the ListingItem records of projections.py. Memory is the peak
+    allocated while loading a page, as traced by tracemalloc.
+    """
+    import tracemalloc
+    from flask import g
+    from teknologkoren_se import projections as read_models
+
+    def load_objects(page):
+        posts = (Post.query.filter_by(published=True)
+                 .order_by(Post.timestamp.desc())
+                 .paginate(page, page_size))
+        for post in posts.items:
+            post.title, post.slug, post.timestamp, post.image
+            post.excerpt, post.readmore
+            if isinstance(post, Event):
+                post.start_time, post.location
+        return posts.items
+
+    def load_records(page):
+        posts = (read_models.listing(g.lang_code)
+                 .filter(Post.published == True)
+                 .order_by(Post.timestamp.desc()))
+        return read_models.paginate(posts, page, page_size).items
+
+    with temporary_database():
+        seed(paragraphs=paragraphs)
+
+        with app.test_request_context('/sv/'):
+            g.lang_code = 'sv'
+            for label, load in (('orm', load_objects),
+                                ('projection', load_records)):
+                pages = Post.query.filter_by(published=True).count()
+                pages = -(-pages // page_size)
+
+                times = []
+                for i in range(rounds):
+                    start = time.perf_counter()
+                    load(i % pages + 1)
+                    times.append(time.perf_counter() - start)
+                    db.session.remove()
+
+                tracemalloc.start()
+                load(1)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                db.session.remove()
+
+                print('{:<12} p50 {:>6.2f} ms  p95 {:>6.2f} ms  '
+                      'peak {:>8.1f} KiB'.format(
+                          label,
+                          percentile(times, 0.5) * 1000,
+                          percentile(times, 0.95) * 1000,
+                          peak / 1024))
+
+
+def memory_usage(pid):
+    """Return the resident, proportional, shared and private memory of
+    a process in KiB, from /proc/<pid>/smaps_rollup.
+    """
+    fields = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'shared': fields['Shared_Clean'] + fields['Shared_Dirty'],
+        'private': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+@manager.option('pid', type=int, help="pid of the gunicorn master")
+def memory(pid):
+    """Resident and shared memory of gunicorn's master and workers.
+
+    PSS (proportional set size) splits shared pages between the
+    processes sharing them, its total is the memory actually used.
+    """
+    with open('/proc/{0}/task/{0}/children'.format(pid)) as f:
+        workers = [int(child) for child in f.read().split()]
+
+    print('{:<16} {:>10} {:>10} {:>10} {:>10}'.format(
+        'process', 'rss KiB', 'pss KiB', 'shared KiB', 'private KiB'))
+
+    total_pss = 0
+    for label, process in ([('master', pid)] +
+                           [('worker', worker) for worker in workers]):
+        usage = memory_usage(process)
+        total_pss += usage['pss']
+        print('{:<16} {rss:>10} {pss:>10} {shared:>10} {private:>10}'.format(
+            '{} {}'.format(label, process), **usage))
+
+    print('total pss {} KiB'.format(total_pss))
+
+
+def connect(address, timeout=10):
+    """Open a socket to `address`, host:port or unix:/path."""
+    if address.startswith('unix:'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address[len('unix:'):])
+    else:
+        host, port = address.rsplit(':', 1)
+        sock = socket.create_connection((host, int(port)), timeout)
+    return sock
+
+
+@manager.option('address', help="host:port or unix:/path of the server")
+@manager.option('-c', '--slow-clients', dest='slow_clients', type=int,
+                default=20)
+@manager.option('-f', '--fast-clients', dest='fast_clients', type=int,
+                default=4)
+@manager.option('-s', '--seconds', dest='seconds', type=float, default=10.0)
+@manager.option('-d', '--delay', dest='delay', type=float, default=0.5,
+                help="Seconds between the chunks slow clients send and read")
+@manager.option('-p', '--path', dest='path', default='/sv/')
+@manager.option('-H', '--host', dest='host', default=None,
+                help="Host header, defaults to SERVER_NAME")
+def slow_clients(address, slow_clients, fast_clients, seconds, delay, path,
+                 host):
+    """Latency of fast clients while slow clients occupy the server.
+
+    Slow clients, like phones on a bad connection, send their request
+    a few bytes at a time and read the response a kilobyte at a time,
+    `delay` seconds apart. Run against each worker profile in
+    etc/systemd, e.g. `gunicorn -c etc/gunicorn.conf.py -b :8000` and
+    `gunicorn -c etc/gunicorn.conf.py --worker-class gthread --threads 8
+    -b :8000`.
+    """
+    host = host or app.config.get('SERVER_NAME') or 'localhost'
+    request = ('GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n'
+               .format(path, host).encode())
+
+    def fast_request():
+        sock = connect(address)
+        try:
+            sock.sendall(request)
+            response = b''
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+        finally:
+            sock.close()
+        return int(response.split(b' ', 2)[1])
+
+    def slow_request(stop):
+        sock = connect(address, timeout=None)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        try:
+            for i in range(0, len(request), 8):
+                if stop.is_set():
+                    return
+                sock.sendall(request[i:i + 8])
+                time.sleep(delay)
+            while not stop.is_set() and sock.recv(1024):
+                time.sleep(delay)
+        finally:
+            sock.close()
+
+    def run(slow):
+        stop = threading.Event()
+        latencies = []
+        errors = []
+
+        def slow_work():
+            while not stop.is_set():
+                try:
+                    slow_request(stop)
+                except OSError:
+                    time.sleep(delay)
+
+        def fast_work():
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    status = fast_request()
+                except OSError:
+                    errors.append(None)
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if not 200 <= status < 300:
+                    errors.append(status)
+
+        threads = []
+        for _ in range(slow):
+            threads.append(threading.Thread(target=slow_work))
+            threads[-1].start()
+        # Let the slow clients take their places first.
+        time.sleep(delay)
+        for _ in range(fast_clients):
+            threads.append(threading.Thread(target=fast_work))
+            threads[-1].start()
+
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        report('{} slow clients'.format(slow), seconds, latencies,
+               len(errors))
+
+    run(0)
+    run(slow_clients)
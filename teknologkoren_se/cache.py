@@ -0,0 +1,330 @@
+import fcntl
+import functools
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from flask import g, has_request_context, request, Response, session
+from teknologkoren_se import app
+from teknologkoren_se.database import read_from_primary
+
+# Every channel gets a counter slot in the shared file. Only append to
+# this, the position of a channel is its offset in the file.
+CHANNELS = (
+    'contacts',
+    'posts',
+    'events',
+    'posts-sv',
+    'posts-en',
+    'events-sv',
+    'events-en',
+)
+
+LANGS = ('sv', 'en')
+
+_COUNTER = struct.Struct('<Q')
+
+
+class InvalidationBus:
+    """Cross-worker cache invalidation without an external service.
+
+    We run several gunicorn workers, each with its own in-process
+    caches. A write handled by one worker has to make the caches of
+    all other workers stale, so the bus keeps a monotonically
+    increasing version counter per channel in a small memory-mapped
+    file shared by all workers.
+
+    Write handlers bump() a channel after committing. Cache layers
+    subscribe() a callback to a channel, and poll(), run before every
+    request, calls the callbacks of all channels whose counter has
+    changed since the last poll. Polling is only a few reads from
+    memory, the file is never read through a system call.
+    """
+    def __init__(self, path, channels=CHANNELS):
+        self.path = path
+        self.channels = channels
+        self._subscribers = {channel: [] for channel in channels}
+        self._seen = None
+        self._mmap = None
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def _offset(self, channel):
+        return self.channels.index(channel) * _COUNTER.size
+
+    def _open(self):
+        if self._mmap is not None:
+            return
+
+        size = len(self.channels) * _COUNTER.size
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        # Several workers may be creating the file at the same time,
+        # only grow it while holding the lock. Growing keeps the
+        # existing counters and fills new ones with zeroes.
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+
+        self._mmap = mmap.mmap(fd, size)
+        self._fd = fd
+
+        # Anything cached before the bus was opened is cached after
+        # these versions, only later bumps invalidate it.
+        self._seen = self.versions()
+
+    def version(self, channel):
+        """Return the current version of a channel."""
+        self._open()
+        return _COUNTER.unpack_from(self._mmap, self._offset(channel))[0]
+
+    def versions(self):
+        """Return a dict mapping all channels to their versions."""
+        return {channel: self.version(channel) for channel in self.channels}
+
+    def subscribe(self, channel, callback=None):
+        """Call `callback` whenever `channel` is bumped.
+
+        Can also be used as a decorator:
+        ```
+        @bus.subscribe('posts')
+        def clear_posts():
+            ...
+        ```
+        """
+        if callback is None:
+            return lambda f: self.subscribe(channel, f)
+
+        self._subscribers[channel].append(callback)
+        return callback
+
+    def bump(self, *channels):
+        """Increment the version of channels, invalidating caches.
+
+        The local subscribers are called immediately, the other
+        workers notice the new version on their next poll.
+        """
+        self._open()
+
+        # lockf() only excludes other processes, the thread lock
+        # excludes other threads in this process.
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                for channel in channels:
+                    offset = self._offset(channel)
+                    version = _COUNTER.unpack_from(self._mmap, offset)[0]
+                    _COUNTER.pack_into(self._mmap, offset, version + 1)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+        self.poll()
+
+    def poll(self):
+        """Call subscribers of channels changed since the last poll."""
+        self._open()
+
+        versions = self.versions()
+        seen, self._seen = self._seen, versions
+
+        for channel, version in versions.items():
+            if version != seen[channel]:
+                for callback in self._subscribers[channel]:
+                    callback()
+
+
+bus = InvalidationBus(os.path.join(app.config['CACHE_DIR'], 'invalidation'))
+
+
+@app.before_request
+def poll_invalidation_bus():
+    bus.poll()
+
+
+def record_cache_status(status):
+    """Note whether the request was served from a cache, for the
+    request log: 'hit', 'miss' or 'coalesced'. A miss is kept if the
+    request uses a cache again.
+    """
+    if has_request_context() and g.get('cache_status') != 'miss':
+        g.cache_status = status
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one.
+
+    The first caller of do() with a key runs the function, callers
+    with the same key arriving before it has returned wait for it and
+    get the same result (or exception).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            try:
+                call.result = func()
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+
+        return call.result
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def coalesce(view):
+    """Let concurrent identical requests to a view share one render.
+
+    For pages that are expensive to render and requested in bursts,
+    e.g. the first page right after publishing. The response is
+    rendered to the end before it is shared, so a streamed page is no
+    longer streamed. Requests with flashed messages in their session
+    are not shared, their pages differ.
+    """
+    flights = SingleFlight()
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if (request.method not in ('GET', 'HEAD') or
+                session.get('_flashes')):
+            return view(*args, **kwargs)
+
+        def render():
+            record_cache_status('miss')
+            response = app.make_response(view(*args, **kwargs))
+            body = response.get_data()
+            return body, response.status_code, list(response.headers)
+
+        key = (request.full_path, g.get('lang_code'))
+        body, status, headers = flights.do(key, render)
+        if 'cache_status' not in g:
+            # Rendered by another request.
+            record_cache_status('coalesced')
+        # The headers are shared as a list, every Response gets its
+        # own Headers from it for its after_request hooks to change.
+        return Response(body, status, headers)
+
+    return wrapper
+
+
+class CachedDocument:
+    """A generated document kept in memory until its data changes.
+
+    `build` is called with a key (e.g. a lang code) and returns the
+    document as a string, which is encoded and kept together with an
+    ETag until one of `channels` is bumped on the bus. Serving a cached
+    document does not touch the database.
+
+    Documents built from the same data can be built together: if
+    `build` returns a dict mapping keys to documents, all of them are
+    cached.
+
+    Documents keyed by lang code can list channels in `lang_channels`
+    too: when only one language of the content changes, e.g.
+    `posts-sv`, only the document of that language is discarded.
+    """
+    def __init__(self, build, channels, mimetype, lang_channels=()):
+        self.build = build
+        self.mimetype = mimetype
+        self._documents = {}
+        self._flights = SingleFlight()
+        # Incremented whenever documents are discarded. Documents
+        # built meanwhile might have been built from the old data and
+        # are not kept.
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        for channel in channels:
+            bus.subscribe(channel, self.clear)
+
+        for channel in lang_channels:
+            for lang_code in LANGS:
+                bus.subscribe('{}-{}'.format(channel, lang_code),
+                              functools.partial(self.discard, lang_code))
+
+    def get(self, key):
+        """Return the document and its ETag, building it if needed.
+
+        Concurrent requests for a document that is not cached wait for
+        a single build.
+        """
+        document = self._documents.get(key)
+
+        if document is None:
+            document = self._flights.do(key, lambda: self._build(key))
+
+        return document
+
+    def _build(self, key):
+        # Another thread might have built it while we were waiting.
+        document = self._documents.get(key)
+        if document is not None:
+            return document
+
+        generation = self._generation
+        with read_from_primary():
+            built = self.build(key)
+        if not isinstance(built, dict):
+            built = {key: built}
+
+        encoded = {}
+        for built_key, body in built.items():
+            body = body.encode('utf-8')
+            encoded[built_key] = (body, hashlib.sha1(body).hexdigest())
+
+        with self._lock:
+            if self._generation == generation:
+                documents = dict(self._documents)
+                documents.update(encoded)
+                self._documents = documents
+
+        return encoded[key]
+
+    def response(self, key):
+        """Return the document as a response, or 304 if not modified."""
+        record_cache_status('hit' if key in self._documents else 'miss')
+        body, etag = self.get(key)
+
+        response = Response(body, mimetype=self.mimetype)
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    def discard(self, key):
+        with self._lock:
+            self._generation += 1
+            self._documents = {
+                cached_key: document
+                for cached_key, document in self._documents.items()
+                if cached_key != key}
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._documents = {}
@@ -0,0 +1,78 @@
+"""Change log of posts and events, backing /api/changes.
+
+Whenever posts or events are flushed, their updated_at is set and
+their row in the change table is replaced in the same transaction,
+deletes included. See models.Change.
+
+The ids of the change table are the cursor of /api/changes, so a row
+must never become visible after a row with a higher id, or a client
+that has polled past it never sees it. SQLite only has one writer at
+a time. On PostgreSQL, transactions writing changes take a lock on the
+table that is held until they commit, so they commit in the order of
+their ids. Reads of the table are not blocked.
+"""
+from datetime import datetime
+from sqlalchemy import and_, event
+from teknologkoren_se.database import RoutingSession
+from teknologkoren_se.models import Change, Post
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def touch_updated_at(session, flush_context, instances):
+    now = datetime.utcnow()
+    for obj in session.dirty:
+        if isinstance(obj, Post) and session.is_modified(obj):
+            obj.updated_at = now
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def record_changes(session, flush_context):
+    changed = [(obj, False) for obj in session.new]
+    changed += [(obj, False) for obj in session.dirty
+                if session.is_modified(obj)]
+    changed += [(obj, True) for obj in session.deleted]
+
+    changed = [(obj, deleted) for obj, deleted in changed
+               if isinstance(obj, Post)]
+    if not changed:
+        return
+
+    now = datetime.utcnow()
+    table = Change.__table__
+    connection = session.connection()
+
+    if connection.dialect.name == 'postgresql':
+        # Conflicts with itself and with inserts, not with selects.
+        connection.execute('LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE'
+                           .format(connection.dialect.identifier_preparer
+                                   .format_table(table)))
+
+    for obj, deleted in changed:
+        # Delete and insert rather than update, the row gets a new id.
+        connection.execute(table.delete().where(and_(
+            table.c.type == obj.type,
+            table.c.object_id == obj.id)))
+        connection.execute(table.insert().values(
+            type=obj.type,
+            object_id=obj.id,
+            deleted=deleted,
+            changed_at=now))
+
+
+def changes_since(cursor, limit):
+    """Return up to `limit` changes after `cursor`, oldest first.
+
+    Returns a list of (change, post) tuples, post is None for
+    deleted posts.
+    """
+    changes = (Change.query
+               .filter(Change.id > cursor)
+               .order_by(Change.id)
+               .limit(limit)
+               .all())
+
+    ids = [change.object_id for change in changes if not change.deleted]
+    posts = {post.id: post
+             for post in Post.query.filter(Post.id.in_(ids))} if ids else {}
+
+    return [(change, posts.get(change.object_id)) for change in changes]
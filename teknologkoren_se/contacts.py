@@ -0,0 +1,71 @@
+import threading
+from teknologkoren_se.cache import bus, record_cache_status
+from teknologkoren_se.database import read_from_primary
+from teknologkoren_se.models import Contact
+
+
+class ContactRepository:
+    """Process-wide cache of all contacts.
+
+    All contacts are loaded with a single query, ordered by weight, and
+    roles (e.g. the chairman) are looked up in memory. Contacts change
+    a few times a year, so the list is kept until the 'contacts'
+    channel of the invalidation bus is bumped, in this or any other
+    worker. The contacts are stored as dicts as model instances would
+    be detached from their session after the first request.
+    """
+    def __init__(self):
+        # (contacts, by_title), replaced as a whole so that threads
+        # never see one without the other.
+        self._cached = None
+        # Incremented by clear(), contacts loaded while it was cleared
+        # might be stale and are not kept.
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        cached = self._cached
+        if cached is not None:
+            record_cache_status('hit')
+            return cached
+
+        record_cache_status('miss')
+        generation = self._generation
+
+        with read_from_primary():
+            contacts = [contact.to_dict() for contact in
+                        Contact.query.order_by(Contact.weight.asc())]
+
+        by_title = {}
+        for contact in contacts:
+            by_title.setdefault(contact['title'], contact)
+
+        cached = (contacts, by_title)
+        with self._lock:
+            if self._generation == generation:
+                self._cached = cached
+        return cached
+
+    def all(self):
+        """Return all contacts ordered by weight."""
+        contacts, by_title = self._load()
+        return contacts
+
+    def by_title(self, title):
+        """Return the first contact with a title, or None."""
+        contacts, by_title = self._load()
+        return by_title.get(title)
+
+    def chairman(self):
+        """Return the chairman, or None if there is no chairman."""
+        return self.by_title('Ordförande')
+
+    def clear(self):
+        """Throw away the cached contacts of this worker."""
+        with self._lock:
+            self._generation += 1
+            self._cached = None
+
+
+board = ContactRepository()
+bus.subscribe('contacts', board.clear)
@@ -0,0 +1,153 @@
+import contextlib
+import sqlite3
+import threading
+from flask import has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+# Requests made by the app itself (e.g. the cache warmer) with this in
+# their environ read from the primary. Clients cannot set it, headers
+# end up in the environ prefixed with HTTP_.
+PRIMARY_ENVIRON_KEY = 'teknologkoren_se.read_from_primary'
+
+_primary = threading.local()
+
+
+@contextlib.contextmanager
+def read_from_primary():
+    """Read from the primary database in this thread.
+
+    For filling caches that are kept until the next write: a replica
+    might not have the write yet when a bump of the invalidation bus
+    makes them rebuild, and the stale result would be kept.
+    """
+    previous = getattr(_primary, 'active', False)
+    _primary.active = True
+    try:
+        yield
+    finally:
+        _primary.active = previous
+
+
+# Config key of every pragma applied to new SQLite connections.
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'SQLITE_JOURNAL_MODE'),
+    ('busy_timeout', 'SQLITE_BUSY_TIMEOUT'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE'),
+    ('cache_size', 'SQLITE_CACHE_SIZE'),
+    ('temp_store', 'SQLITE_TEMP_STORE'),
+)
+
+
+class RoutingSession(SignallingSession):
+    """Session sending reads from the public pages to a read replica.
+
+    If a bind called 'replica' is configured in SQLALCHEMY_BINDS, GET
+    and HEAD requests to the blueprints in SQLALCHEMY_REPLICA_BLUEPRINTS
+    read from it. Everything else, including all of the api, anything
+    that is flushed, requests from the app itself and reads in
+    read_from_primary(), uses the primary database.
+
+    The replica can lag behind. Pages are rendered from it right after
+    a write, so they (and the edge cache, see http_cache.py) might show
+    the old content until they are rendered again. Caches kept until
+    the next write are filled from the primary.
+    """
+    def get_bind(self, mapper=None, clause=None):
+        if self._use_replica():
+            state = get_state(self.app)
+            return state.db.get_engine(self.app, bind='replica')
+
+        return super().get_bind(mapper, clause)
+
+    def _use_replica(self):
+        # _flushing is private to SQLAlchemy's Session, set while
+        # flush() runs. Checked as writes must not go to the replica.
+        if (self._flushing or getattr(_primary, 'active', False) or
+                not has_request_context() or
+                request.environ.get(PRIMARY_ENVIRON_KEY)):
+            return False
+
+        if 'replica' not in (self.app.config['SQLALCHEMY_BINDS'] or {}):
+            return False
+
+        blueprints = self.app.config['SQLALCHEMY_REPLICA_BLUEPRINTS']
+        return (request.blueprint in blueprints and
+                request.method in ('GET', 'HEAD'))
+
+
+class Database(SQLAlchemy):
+    """Flask-SQLAlchemy with read/write routing and pool tuning.
+
+    Pool size, overflow, timeout and recycle are configured with
+    Flask-SQLAlchemy's own SQLALCHEMY_POOL_* settings,
+    SQLALCHEMY_POOL_PRE_PING additionally makes the pool test
+    connections before handing them out.
+
+    SQLite connections are normally not pooled. If SQLALCHEMY_POOL_SIZE
+    is set they are, so that the page cache and memory map of a
+    connection are reused between requests.
+    """
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_POOL_PRE_PING', False)
+        app.config.setdefault('SQLALCHEMY_REPLICA_BLUEPRINTS',
+                              ('blog', 'events', 'general', 'sitemap'))
+        app.config.setdefault('SQLITE_JOURNAL_MODE', 'WAL')
+        app.config.setdefault('SQLITE_BUSY_TIMEOUT', 5000)
+        app.config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')
+        app.config.setdefault('SQLITE_MMAP_SIZE', 64 * 1024 * 1024)
+        app.config.setdefault('SQLITE_CACHE_SIZE', -16000)
+        app.config.setdefault('SQLITE_TEMP_STORE', 'MEMORY')
+
+        super().init_app(app)
+        setup_sqlite_pragmas(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        super().apply_driver_hacks(app, info, options)
+
+        if info.drivername != 'sqlite':
+            options.setdefault('pool_pre_ping',
+                               app.config['SQLALCHEMY_POOL_PRE_PING'])
+        elif (options.get('pool_size') and
+              info.database not in (None, '', ':memory:')):
+            # Pooled connections are handed to different threads.
+            options['poolclass'] = QueuePool
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['check_same_thread'] = False
+
+
+def setup_sqlite_pragmas(app):
+    """Apply the configured pragmas to every new SQLite connection.
+
+    journal_mode: In WAL mode readers do not block writers and the
+        other way around, which matters as the api commits while the
+        pages are read.
+    busy_timeout: Milliseconds a writer waits for the lock instead of
+        failing immediately with "database is locked".
+    synchronous: NORMAL is safe in WAL mode and does not fsync on
+        every commit.
+    mmap_size: Bytes of the database file read through a memory map
+        instead of read() calls.
+    cache_size: Page cache per connection, in KiB if negative.
+    temp_store: Where temporary tables and indices (e.g. for sorting)
+        are kept.
+
+    A pragma configured as None is left at SQLite's default.
+    """
+    @event.listens_for(Engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+
+        cursor = dbapi_connection.cursor()
+        for pragma, key in SQLITE_PRAGMAS:
+            value = app.config[key]
+            if value is not None:
+                cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+        cursor.close()
@@ -0,0 +1,51 @@
+"""Excerpts of posts and events for the overview pages.
+
+An excerpt is the first EXCERPT_BLOCKS top-level blocks (paragraphs,
+lists, headers, ...) of the rendered content. Excerpts are rendered
+when the content is written and stored with the post, so listing
+pages neither run Markdown nor send the full text of every post.
+"""
+from collections import namedtuple
+from markdown import Markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+
+EXCERPT_BLOCKS = 3
+
+Excerpt = namedtuple('Excerpt', 'html more')
+
+
+class TruncateProcessor(Treeprocessor):
+    """Drop all but the first `blocks` top-level elements."""
+    def __init__(self, md, blocks):
+        super().__init__(md)
+        self.blocks = blocks
+        self.truncated = False
+
+    def run(self, root):
+        children = list(root)
+        self.truncated = len(children) > self.blocks
+        for child in children[self.blocks:]:
+            root.remove(child)
+
+
+class ExcerptExtension(Extension):
+    def __init__(self, blocks):
+        super().__init__()
+        self.processor = None
+        self.blocks = blocks
+
+    def extendMarkdown(self, md, md_globals):
+        self.processor = TruncateProcessor(md, self.blocks)
+        # Last, after e.g. inline markup has been processed.
+        md.treeprocessors.add('excerpt', self.processor, '_end')
+
+
+def make_excerpt(content, blocks=EXCERPT_BLOCKS):
+    """Return the excerpt of Markdown content as an Excerpt.
+
+    `more` is true if the content continues after the excerpt.
+    """
+    extension = ExcerptExtension(blocks)
+    html = Markdown(extensions=[extension]).convert(content)
+    return Excerpt(html, extension.processor.truncated)
@@ -0,0 +1,183 @@
+"""Cache-Control and surrogate-key headers for an edge cache.
+
+Every public endpoint has a cache policy: how long browsers (max-age)
+and shared caches such as the nginx micro-cache (s-maxage) may keep
+the response, and which surrogate keys it is tagged with. Responses
+are also tagged with every post and event loaded while handling the
+request, as `post-<id>`. Pages of one language are tagged with every
+key once more with the lang code appended, e.g. `post-12:sv`, so that
+a change to the Swedish text only purges Swedish pages.
+
+When content changes, the api purges the affected keys. The urls of
+the responses tagged with a key are recorded in a small SQLite
+database shared by all workers, and every url is purged from the
+cache through CACHE_PURGE_URL, e.g. an nginx location running
+proxy_cache_purge. Without CACHE_PURGE_URL nothing is recorded and
+purging does nothing, the headers are sent anyway.
+"""
+import os
+import sqlite3
+import threading
+import urllib.request
+from flask import g, request, session
+from sqlalchemy import event
+from teknologkoren_se import app
+from teknologkoren_se.models import Post
+
+# Endpoint: (max-age, s-maxage, surrogate keys). Pages with a listing
+# are tagged with what is listed, so that new posts and events purge
+# them.
+CACHE_POLICIES = {
+    'blog.index': (60, 600, ['posts', 'events']),
+    'blog.view_post': (300, 3600, []),
+    'blog.search': (60, 600, ['posts', 'events']),
+    'events.index': (60, 600, ['events']),
+    'events.archive': (300, 3600, ['events']),
+    'events.view_event': (300, 3600, []),
+    'events.ics': (300, 3600, ['events']),
+    'events.widgets': (60, 60, []),
+    'general.about': (3600, 86400, []),
+    'general.hire': (3600, 86400, []),
+    'general.sing': (3600, 86400, []),
+    'general.contact': (300, 3600, ['contacts']),
+    'general.lucia': (300, 3600, ['contacts']),
+    'general.atom_feed': (300, 3600, ['posts', 'events']),
+    'sitemap.index': (3600, 3600, ['posts', 'events']),
+    'sitemap.sitemap': (3600, 3600, ['posts', 'events']),
+    # Images never change under the same filename.
+    'resize.static_image': (2592000, 2592000, []),
+    'resize.uploaded_image': (2592000, 2592000, []),
+}
+
+
+class Purger:
+    """Record which urls have which surrogate keys and purge them.
+
+    `send` is called with the path of every url to purge. By default
+    it requests CACHE_PURGE_URL with the path appended, tests can use
+    any stand-in.
+    """
+    def __init__(self, path, send=None):
+        self.path = path
+        self.send = send or self.send_purge_request
+        self._recorded = set()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute('CREATE TABLE IF NOT EXISTS surrogate_key ('
+                     'key TEXT, url TEXT, PRIMARY KEY (key, url)) '
+                     'WITHOUT ROWID')
+        return conn
+
+    def record(self, url, keys):
+        """Remember that the response for `url` is tagged with `keys`.
+
+        Most responses have the same keys as the last time they were
+        rendered, those are only written once per worker.
+        """
+        recorded = (url, frozenset(keys))
+        if recorded in self._recorded:
+            return
+
+        with self._connect() as conn:
+            conn.executemany('INSERT OR IGNORE INTO surrogate_key '
+                             'VALUES (?, ?)',
+                             [(key, url) for key in keys])
+
+        with self._lock:
+            self._recorded.add(recorded)
+
+    def purge(self, *keys):
+        """Purge every cached url tagged with any of `keys`."""
+        if not app.config['CACHE_PURGE_URL']:
+            return
+
+        placeholders = ', '.join('?' * len(keys))
+        with self._connect() as conn:
+            urls = [url for url, in conn.execute(
+                'SELECT DISTINCT url FROM surrogate_key '
+                'WHERE key IN ({})'.format(placeholders), keys)]
+            conn.execute('DELETE FROM surrogate_key WHERE url IN '
+                         '(SELECT url FROM surrogate_key WHERE key IN '
+                         '({}))'.format(placeholders), keys)
+
+        # The urls have to be recorded again when rendered next time.
+        with self._lock:
+            self._recorded = {recorded for recorded in self._recorded
+                              if recorded[0] not in urls}
+
+        for url in urls:
+            self.send(url)
+
+    def send_purge_request(self, url):
+        purge_url = app.config['CACHE_PURGE_URL'] + url
+        try:
+            urllib.request.urlopen(purge_url, timeout=2).close()
+        except urllib.error.HTTPError as e:
+            # 404 means the url was not cached
+            if e.code != 404:
+                app.logger.warning('Purging %s failed: %s', url, e)
+        except OSError as e:
+            app.logger.warning('Purging %s failed: %s', url, e)
+
+
+purger = Purger(os.path.join(app.config['CACHE_DIR'], 'surrogate_keys.db'))
+
+
+def purge(*keys):
+    """Purge responses tagged with `keys` from the edge cache."""
+    purger.purge(*keys)
+
+
+@event.listens_for(Post, 'load', propagate=True)
+def tag_loaded_post(target, context):
+    """Tag the response with every post or event it was built from."""
+    keys = g.get('surrogate_keys')
+    if keys is not None:
+        keys.add('post-{}'.format(target.id))
+
+
+@app.before_request
+def start_tagging():
+    g.surrogate_keys = set()
+
+
+@app.after_request
+def set_cache_headers(response):
+    policy = CACHE_POLICIES.get(request.endpoint)
+
+    if request.blueprint == 'api':
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    if not g.get('lang_from_url') and request.endpoint not in CACHE_POLICIES:
+        # E.g. the redirects from paths without a lang code, which
+        # depend on the cookie and the browser's language.
+        response.vary.update(('Cookie', 'Accept-Language'))
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    # The session cookie is only added after this hook, when the
+    # session has been modified.
+    if (policy is None or response.status_code != 200 or
+            session.modified or 'Set-Cookie' in response.headers):
+        return response
+
+    max_age, s_maxage, keys = policy
+    keys = g.surrogate_keys.union(keys)
+    if g.get('lang_from_url'):
+        keys.update(['{}:{}'.format(key, g.lang_code) for key in keys])
+
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.s_maxage = s_maxage
+    if keys:
+        response.headers['Surrogate-Key'] = ' '.join(sorted(keys))
+
+    if app.config['CACHE_PURGE_URL']:
+        url = request.script_root + request.full_path.rstrip('?')
+        purger.record(url, keys)
+
+    return response
@@ -0,0 +1,129 @@
+"""Minimal iCalendar (RFC 5545) serialization."""
+import re
+from html.parser import HTMLParser
+from markdown import markdown
+
+# Elements ending a line of the plain text.
+BLOCK_ELEMENTS = {'p', 'div', 'br', 'li', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4',
+                  'h5', 'h6', 'blockquote', 'pre', 'tr'}
+
+
+class TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip += 1
+        elif tag == 'li':
+            self.parts.append('\n- ')
+        elif tag in BLOCK_ELEMENTS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_ELEMENTS and tag != 'li':
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        # Newlines between elements are not part of the text.
+        if self._skip or (data.isspace() and '\n' in data):
+            return
+        self.parts.append(data)
+
+
+def markdown_to_text(content):
+    """Return Markdown content (with any embedded html) as plain text,
+    for calendar clients that show descriptions as they are.
+    """
+    extractor = TextExtractor()
+    extractor.feed(markdown(content))
+    extractor.close()
+
+    lines = (' '.join(line.split())
+             for line in ''.join(extractor.parts).split('\n'))
+    text = '\n'.join(lines)
+    # At most one empty line between paragraphs.
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+
+def escape_text(value):
+    """Escape a TEXT property value."""
+    return (value.replace('\\', '\\\\')
+            .replace(';', '\\;')
+            .replace(',', '\\,')
+            .replace('\r\n', '\\n')
+            .replace('\n', '\\n'))
+
+
+def format_datetime(value):
+    """Format a naive UTC datetime as an UTC DATE-TIME."""
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def fold(line):
+    """Fold a content line into lines of at most 75 octets.
+
+    Continuation lines start with a space. Lines are only split between
+    characters, never inside a multi-byte UTF-8 sequence.
+    """
+    lines = []
+    current = ''
+    current_length = 0
+    limit = 75
+
+    for char in line:
+        length = len(char.encode('utf-8'))
+        if current_length + length > limit:
+            lines.append(current)
+            current = ' '
+            current_length = 1
+        current += char
+        current_length += length
+
+    lines.append(current)
+    return '\r\n'.join(lines)
+
+
+def property_line(name, value, escape=True):
+    return fold('{}:{}'.format(name, escape_text(value) if escape else value))
+
+
+def serialize(calendar_properties, events):
+    """Return a VCALENDAR with VEVENTs as a string.
+
+    `calendar_properties` is a list of (name, value) tuples and
+    `events` a list of such lists. Values are escaped as TEXT unless
+    the name ends up in `RAW_PROPERTIES`.
+    """
+    lines = ['BEGIN:VCALENDAR']
+    lines.extend(property_line(name, value, name not in RAW_PROPERTIES)
+                 for name, value in calendar_properties)
+
+    for event in events:
+        lines.append('BEGIN:VEVENT')
+        lines.extend(property_line(name, value, name not in RAW_PROPERTIES)
+                     for name, value in event)
+        lines.append('END:VEVENT')
+
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+# Properties whose values are not TEXT and must not be escaped.
+RAW_PROPERTIES = {
+    'VERSION',
+    'CALSCALE',
+    'METHOD',
+    'DTSTAMP',
+    'DTSTART',
+    'DTEND',
+    'DURATION',
+    'LAST-MODIFIED',
+    'URL',
+    'REFRESH-INTERVAL;VALUE=DURATION',
+    'X-PUBLISHED-TTL',
+}
@@ -0,0 +1,189 @@
+"""Resized images, cached on disk.
+
+Images are requested in a few widths (IMAGE_WIDTHS) with urls like
+/static/uploads/images/img800/<filename>. The first request for a
+width resizes the image with Pillow and writes the result to
+IMAGE_CACHE_DIR under the same path as the url, where nginx serves it
+from on later requests without asking the app.
+
+Workers resizing the same image wait for each other on a file lock, so
+an image is only resized once. When the cache outgrows
+IMAGE_CACHE_SIZE bytes, the least recently used images are removed.
+Hits served by nginx are not seen by the app, their use is read from
+the access time of the file, which on a filesystem mounted with
+relatime is updated at most once a day.
+
+Without Pillow installed, nothing is resized and the views redirect to
+the original images.
+"""
+import contextlib
+import fcntl
+import os
+import shutil
+import tempfile
+import time
+import zlib
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Number of lock files, images hashing to the same one wait for each
+# other.
+LOCK_STRIPES = 64
+
+# The cache is shrunk to this fraction of its size budget, so that it
+# is not scanned again for every new image.
+EVICT_TO = 0.9
+
+
+class DerivativeCache:
+    """Resized images in `directory`, at most `size` bytes of them."""
+    def __init__(self, directory, size, quality=85):
+        self.directory = directory
+        self.size = size
+        self.quality = quality
+        self._locks = os.path.join(directory, '.locks')
+
+    def path(self, url_path):
+        """Return where the image at `url_path` is cached."""
+        return os.path.join(self.directory, url_path.lstrip('/'))
+
+    def get(self, source, url_path, width):
+        """Return the path of `source` resized to `width` pixels wide,
+        resizing it if it is not cached.
+        """
+        target = self.path(url_path)
+
+        if os.path.exists(target):
+            self._touch(target)
+            return target
+
+        stripe = zlib.crc32(url_path.encode('utf-8')) % LOCK_STRIPES
+        with self._lock(str(stripe)):
+            # Might have been resized while we waited for the lock.
+            created = not os.path.exists(target)
+            if created:
+                self.resize(source, target, width)
+
+        if created:
+            self.evict(keep=target)
+
+        return target
+
+    def resize(self, source, target, width):
+        """Write `source` scaled down to `width` pixels wide to `target`.
+
+        Images that are not wider are copied as they are, like nginx's
+        image_filter they are never scaled up. So are files that Pillow
+        cannot read.
+        """
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.resize-')
+        os.close(fd)
+
+        try:
+            try:
+                image = Image.open(source)
+            except OSError:
+                # Not a bitmap, e.g. an svg, which scales by itself.
+                shutil.copyfile(source, temporary)
+            else:
+                with image:
+                    if image.width <= width:
+                        shutil.copyfile(source, temporary)
+                    else:
+                        self.scale(image, temporary, width)
+
+            # mkstemp() makes the file readable by us only, not nginx.
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, target)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def scale(self, image, path, width):
+        image_format = image.format
+        # Photos from phones are often rotated with exif.
+        image = ImageOps.exif_transpose(image)
+        height = round(image.height * width / image.width)
+        image = image.resize((width, height), Image.LANCZOS)
+        self.save(image, path, image_format)
+
+    def save(self, image, path, image_format):
+        if image_format == 'JPEG':
+            image.save(path, image_format, quality=self.quality,
+                       optimize=True, progressive=True)
+        else:
+            image.save(path, image_format, optimize=True)
+
+    def evict(self, keep=None):
+        """Remove the least recently used images if over the budget,
+        but not `keep`, the image about to be sent.
+
+        Only one worker evicts at a time, the others skip it.
+        """
+        with self._lock('evict', blocking=False) as locked:
+            if not locked:
+                return
+
+            files = []
+            total = 0
+            for root, directories, filenames in os.walk(self.directory):
+                if root == self.directory and '.locks' in directories:
+                    directories.remove('.locks')
+                for filename in filenames:
+                    if filename.startswith('.resize-'):
+                        continue
+                    path = os.path.join(root, filename)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    total += stat.st_size
+                    files.append((max(stat.st_atime, stat.st_mtime),
+                                  stat.st_size, path))
+
+            if total <= self.size:
+                return
+
+            files.sort()
+            for used, size, path in files:
+                if total <= self.size * EVICT_TO:
+                    break
+                if path == keep:
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                total -= size
+
+    @staticmethod
+    def _touch(path):
+        """Mark an image as used, keeping its modification time."""
+        with contextlib.suppress(OSError):
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+
+    @contextlib.contextmanager
+    def _lock(self, name, blocking=True):
+        """Hold a lock file, yielding whether it was taken.
+
+        flock() locks belong to the open file, so threads of the same
+        worker exclude each other too.
+        """
+        os.makedirs(self._locks, exist_ok=True)
+
+        with open(os.path.join(self._locks, name), 'a') as f:
+            flags = fcntl.LOCK_EX if blocking else \
+                fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(f, flags)
+            except BlockingIOError:
+                yield False
+                return
+
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
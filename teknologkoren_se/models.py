@@ -1,13 +1,20 @@
 import phonenumbers
-import flask_sqlalchemy
 from datetime import datetime
 from flask_babel import get_locale, gettext
 from markdown import markdown
 from slugify import slugify
-from sqlalchemy import event
-from teknologkoren_se import images
+from sqlalchemy import event, inspect
+from teknologkoren_se import db, images
+from teknologkoren_se.excerpts import Excerpt, make_excerpt
 
-db = flask_sqlalchemy.SQLAlchemy()
+
+def changed_fields(obj):
+    """Return the names of the attributes changed since last commit.
+
+    Setting an attribute to the value it already has is not a change.
+    """
+    return {attr.key for attr in inspect(obj).attrs
+            if attr.history.has_changes()}
 
 
 class Contact(db.Model):
@@ -24,28 +31,9 @@ class Contact(db.Model):
     last_name = db.Column(db.String(50))
     email = db.Column(db.String(254))
     phone = db.Column(db.String(20), nullable=True)
+    formatted_phone = db.Column(db.String(30), nullable=True)
     weight = db.Column(db.Integer)
 
-    @property
-    def formatted_phone(self):
-        """Returns formatted number or False if not a valid number."""
-        try:
-            # If no country code, assume Swedish
-            parsed = phonenumbers.parse(self.phone, 'SE')
-        except phonenumbers.phonenumberutil.NumberParseException:
-            return False
-
-        if not (phonenumbers.is_possible_number(parsed) and
-                phonenumbers.is_valid_number(parsed)):
-            return False
-
-        formatted = phonenumbers.format_number(
-            parsed,
-            phonenumbers.PhoneNumberFormat.INTERNATIONAL
-        )
-
-        return formatted
-
     def to_dict(self):
         d = {}
         d['id'] = self.id
@@ -54,10 +42,39 @@ class Contact(db.Model):
         d['last_name'] = self.last_name
         d['email'] = self.email
         d['phone'] = self.phone
+        d['formatted_phone'] = self.formatted_phone
         d['weight'] = self.weight
         return d
 
 
+def format_phone(phone):
+    """Return formatted number or None if not a valid number."""
+    try:
+        # If no country code, assume Swedish
+        parsed = phonenumbers.parse(phone, 'SE')
+    except phonenumbers.phonenumberutil.NumberParseException:
+        return None
+
+    if not (phonenumbers.is_possible_number(parsed) and
+            phonenumbers.is_valid_number(parsed)):
+        return None
+
+    return phonenumbers.format_number(
+        parsed,
+        phonenumbers.PhoneNumberFormat.INTERNATIONAL
+    )
+
+
+@event.listens_for(Contact.phone, 'set')
+def set_formatted_phone(target, value, oldvalue, initiator):
+    """Format and store phone number when a new number is set.
+
+    Parsing and validating is relatively heavy, so it is done once
+    when the number is written instead of every time it is displayed.
+    """
+    target.formatted_phone = format_phone(value) if value else None
+
+
 class Post(db.Model):
     """Representation of a blogpost.
 
@@ -82,8 +99,13 @@ class Post(db.Model):
     content_en = db.Column(db.Text)
     readmore_sv = db.Column(db.Text)
     readmore_en = db.Column(db.Text)
+    excerpt_sv = db.Column(db.Text, nullable=True)
+    excerpt_en = db.Column(db.Text, nullable=True)
+    excerpt_more_sv = db.Column(db.Boolean, default=False)
+    excerpt_more_en = db.Column(db.Boolean, default=False)
     published = db.Column(db.Boolean)
     timestamp = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     image = db.Column(db.String(300), nullable=True)
     type = db.Column(db.String(50))
 
@@ -126,6 +148,42 @@ class Post(db.Model):
 
         return None
 
+    @property
+    def excerpt(self):
+        """Return localized excerpt, see excerpts.py.
+
+        If not available, prepend notice about missing translation. None
+        if no excerpt has been made, the whole content should be shown.
+        """
+        lang = get_locale().language
+
+        if lang == 'sv':
+            if self.content_sv:
+                return self.make_localized_excerpt(self.excerpt_sv,
+                                                   self.excerpt_more_sv)
+            return self.make_localized_excerpt(self.excerpt_en,
+                                               self.excerpt_more_en,
+                                               missing=True)
+
+        if lang == 'en':
+            if self.content_en:
+                return self.make_localized_excerpt(self.excerpt_en,
+                                                   self.excerpt_more_en)
+            return self.make_localized_excerpt(self.excerpt_sv,
+                                               self.excerpt_more_sv,
+                                               missing=True)
+
+    @staticmethod
+    def make_localized_excerpt(html, more, missing=False):
+        if html is None:
+            return None
+
+        if missing:
+            not_available = gettext('(No translation available)\n\n')
+            html = markdown(not_available) + '\n' + html
+
+        return Excerpt(html, more)
+
     @property
     def url(self):
         """Return the path to the post."""
@@ -147,6 +205,7 @@ class Post(db.Model):
         d['readmore_en'] = self.readmore_en
         d['published'] = self.published
         d['timestamp'] = self.timestamp
+        d['updated_at'] = self.updated_at
         d['image'] = self.image
         d['image_path'] = images.url(self.image) if self.image else None
         return d
@@ -165,6 +224,20 @@ def create_slug(target, value, oldvalue, initiator):
     target.slug = slugify(value)
 
 
+@event.listens_for(Post.content_sv, 'set', propagate=True)
+def set_excerpt_sv(target, value, oldvalue, initiator):
+    """Make the Swedish excerpt when the Swedish content is written."""
+    target.excerpt_sv, target.excerpt_more_sv = \
+        make_excerpt(value) if value else (None, False)
+
+
+@event.listens_for(Post.content_en, 'set', propagate=True)
+def set_excerpt_en(target, value, oldvalue, initiator):
+    """Make the English excerpt when the English content is written."""
+    target.excerpt_en, target.excerpt_more_en = \
+        make_excerpt(value) if value else (None, False)
+
+
 class Event(Post):
     """Representation of an event.
 
@@ -183,6 +256,37 @@ class Event(Post):
 
     def to_dict(self):
         d = super().to_dict()
-        d['start_time'] = datetime.strftime(self.start_time, '%Y-%m-%dT%H:%M')
+        d['start_time'] = self.start_time
         d['location'] = self.location
         return d
+
+
+class Image(db.Model):
+    """An uploaded image and the sha256 of its content.
+
+    Used to find an earlier upload of the same image, see uploads.py.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), unique=True, nullable=False)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+
+
+class Change(db.Model):
+    """The latest change of a post or event, for incremental sync.
+
+    Every post and event has one row, replaced (with a new id) every
+    time it is changed. A deleted post keeps its row as a tombstone.
+    The ids are never reused, so they can be used as a cursor: the
+    changes since a cursor are the rows with a higher id. See
+    changes.py.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('type', 'object_id'),
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(50), nullable=False)
+    object_id = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    changed_at = db.Column(db.DateTime, nullable=False)
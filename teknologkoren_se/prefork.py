@@ -0,0 +1,67 @@
+"""Preparing the app for a preforking server, see etc/gunicorn.conf.py.
+
+With the app preloaded in the gunicorn master, the workers are forked
+from it and share its memory until they write to it. Anything loaded
+before forking is loaded only once and, as long as it is only read,
+is kept once in memory for all workers: the imported modules, the
+phone number metadata, the translation catalogs and the compiled
+templates.
+
+Reference counting and the garbage collector write to every object
+they touch, so the objects loaded before forking are moved out of the
+collector's reach with gc.freeze(). Database connections must not be
+shared between processes, so the engines are disposed of both before
+and after forking.
+"""
+import gc
+import time
+import phonenumbers
+from markdown import markdown
+from teknologkoren_se import app, db
+from teknologkoren_se.warmer import warm
+
+
+def preload():
+    """Load everything the workers need, run in the master."""
+    start = time.perf_counter()
+
+    phonenumbers.PhoneMetadata.load_all()
+    markdown('*Teknologkören*')
+
+    for name in app.jinja_env.list_templates(extensions=('html', 'xml')):
+        app.jinja_env.get_template(name)
+
+    # Loads the translation catalogs and everything else the most
+    # visited pages need. One at a time in this thread, and without
+    # the request log and its writer thread: no threads should be
+    # running when forking, a thread holding a lock would leave it
+    # locked in the workers.
+    request_logging = app.config['REQUEST_LOGGING']
+    app.config['REQUEST_LOGGING'] = False
+    try:
+        with app.app_context():
+            warm(concurrency=1)
+    except Exception:
+        app.logger.exception('Warming before forking failed')
+    finally:
+        app.config['REQUEST_LOGGING'] = request_logging
+
+    dispose_engines()
+    gc.freeze()
+
+    app.logger.info('Preloaded in %.2f s, %d objects frozen',
+                    time.perf_counter() - start, gc.get_freeze_count())
+
+
+def after_fork():
+    """Run in every worker after it has been forked."""
+    dispose_engines()
+
+
+def dispose_engines():
+    """Close all pooled database connections."""
+    binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or ())
+
+    with app.app_context():
+        for bind in binds:
+            db.get_engine(app, bind).dispose()
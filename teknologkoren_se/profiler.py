@@ -0,0 +1,140 @@
+"""Profiling of single requests in production.
+
+A request is profiled with cProfile if it has an X-Profile header and
+is authenticated as an api user (HTTP basic auth, like the api), or at
+random for a PROFILE_SAMPLE_RATE fraction of all requests. The profile
+is written as a pstats file to PROFILE_DIR, named after the endpoint,
+and `python manage.py profile_report` sums them up per endpoint.
+
+    curl -u user:password -H 'X-Profile: 1' https://.../sv/
+
+Profiling wraps the whole WSGI application, so a streamed page is
+profiled while it renders. A profiled response is therefore sent at
+once instead of streamed. Other requests only pass through a header
+lookup and, if sampling, a random number.
+"""
+import cProfile
+import itertools
+import os
+import pstats
+import random
+import time
+from collections import namedtuple
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_authorization_header
+from teknologkoren_se import app, token_auth
+
+HotFunction = namedtuple('HotFunction',
+                         ['function', 'calls', 'tottime', 'cumtime'])
+
+EndpointReport = namedtuple('EndpointReport',
+                            ['endpoint', 'requests', 'seconds', 'functions'])
+
+_counter = itertools.count()
+
+
+class ProfilingMiddleware:
+    """Wrap a WSGI application, profiling requests that ask for it."""
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if not self.should_profile(environ):
+            return self.wsgi_app(environ, start_response)
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            response = self.wsgi_app(environ, start_response)
+            try:
+                body = list(response)
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+        finally:
+            profile.disable()
+
+        save_profile(profile, request_endpoint(environ))
+        return body
+
+    @staticmethod
+    def should_profile(environ):
+        if not app.config['PROFILE_DIR']:
+            return False
+
+        if 'HTTP_X_PROFILE' in environ:
+            auth = parse_authorization_header(
+                environ.get('HTTP_AUTHORIZATION'))
+            return bool(auth and token_auth.authenticate(auth, None))
+
+        rate = app.config['PROFILE_SAMPLE_RATE']
+        return rate > 0 and random.random() < rate
+
+
+def request_endpoint(environ):
+    """Return the endpoint the request was routed to."""
+    adapter = app.url_map.bind_to_environ(
+        environ, server_name=app.config['SERVER_NAME'])
+    try:
+        endpoint, view_args = adapter.match()
+    except HTTPException:
+        return 'unmatched'
+
+    return endpoint
+
+
+def save_profile(profile, endpoint):
+    """Write a profile to PROFILE_DIR as <endpoint>@<time>-<pid>-<n>.prof"""
+    directory = app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    filename = '{}@{}-{}-{}.prof'.format(endpoint,
+                                         int(time.time()),
+                                         os.getpid(),
+                                         next(_counter))
+
+    # Written under another name first, so that a report never reads a
+    # partly written file.
+    path = os.path.join(directory, filename)
+    profile.dump_stats(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def report(directory, top=10, sort='tottime', endpoint=None):
+    """Return an EndpointReport per endpoint profiled in `directory`.
+
+    The profiles of each endpoint are added together, `seconds` is the
+    mean time per request spent in profiled code and `functions` are
+    the `top` functions by `sort`, 'tottime' (time in the function
+    itself) or 'cumtime' (including the functions it calls).
+    """
+    files = {}
+    for filename in os.listdir(directory):
+        if not filename.endswith('.prof'):
+            continue
+        name = filename.rsplit('@', 1)[0]
+        if endpoint is None or name == endpoint:
+            files.setdefault(name, []).append(
+                os.path.join(directory, filename))
+
+    reports = []
+    for name, paths in sorted(files.items()):
+        stats = pstats.Stats(*paths)
+
+        functions = []
+        for (filename, line, function), (primitive_calls, calls, tottime,
+                                         cumtime, callers) \
+                in stats.stats.items():
+            functions.append(HotFunction(
+                pstats.func_std_string((filename, line, function)),
+                calls, tottime, cumtime))
+
+        functions.sort(key=lambda f: getattr(f, sort), reverse=True)
+        reports.append(EndpointReport(name,
+                                      len(paths),
+                                      stats.total_tt / len(paths),
+                                      functions[:top]))
+
+    return reports
+
+
+app.wsgi_app = ProfilingMiddleware(app.wsgi_app)
@@ -0,0 +1,174 @@
+"""Read-only projections of posts and events for the listing pages.
+
+The overview pages, the feed and the sitemap only show a few columns
+of every post, in one language. Instead of loading whole Post and
+Event objects (both languages, content and readmore, tracked by the
+session), they select just those columns for the requested language
+into small records.
+
+The translation fallback of Post.content and Post.excerpt is made in
+SQL, so the other language is only sent by the database when a post
+has not been translated.
+"""
+from collections import namedtuple
+from flask import abort
+from flask_babel import gettext
+from flask_sqlalchemy import Pagination
+from markdown import markdown
+from sqlalchemy import case, func, or_
+from teknologkoren_se import db
+from teknologkoren_se.models import Post, Event
+
+LANGS = ('sv', 'en')
+
+event_table = Event.__table__
+
+FeedEntry = namedtuple('FeedEntry',
+                       ['id', 'type', 'title', 'slug', 'timestamp',
+                        'content'])
+
+SitemapEntry = namedtuple('SitemapEntry', ['id', 'type', 'slug', 'lastmod'])
+
+
+class ListingItem:
+    """A post or event as shown on the overview pages.
+
+    Has the attributes the overview mode of the article macros in
+    macros.html uses. `readmore` is only whether there is a readmore,
+    and `content` is None unless the post has no excerpt.
+    """
+    __slots__ = ('id', 'type', 'title', 'slug', 'timestamp', 'image',
+                 'excerpt', 'content', 'readmore', 'start_time', 'location')
+
+    content_to_html = staticmethod(markdown)
+
+    def __init__(self, id, type, title, slug, timestamp, image, translated,
+                 excerpt, excerpt_more, content, readmore, start_time,
+                 location):
+        self.id = id
+        self.type = type
+        self.title = title
+        self.slug = slug
+        self.timestamp = timestamp
+        self.image = image
+        self.excerpt = Post.make_localized_excerpt(excerpt, excerpt_more,
+                                                   missing=not translated)
+        if content is not None and not translated:
+            content = gettext('(No translation available)\n\n') + content
+        self.content = content
+        self.readmore = readmore
+        self.start_time = start_time
+        self.location = location
+
+
+def localized(name, lang, translated):
+    """Return column `name` in `lang`, or in the other language if the
+    post has not been translated.
+    """
+    other, = (other for other in LANGS if other != lang)
+    return case([(translated, getattr(Post, '{}_{}'.format(name, lang)))],
+                else_=getattr(Post, '{}_{}'.format(name, other)))
+
+
+def is_translated(lang):
+    return func.coalesce(getattr(Post, 'content_{}'.format(lang)), '') != ''
+
+
+def listing(lang):
+    """Return a query of the ListingItem columns of posts and events.
+
+    Filter and order it like a query of Post, and turn the rows into
+    records with paginate().
+    """
+    translated = is_translated(lang)
+    excerpt = localized('excerpt', lang, translated)
+
+    return (db.session.query(
+                Post.id,
+                Post.type,
+                Post.title,
+                Post.slug,
+                Post.timestamp,
+                Post.image,
+                translated.label('translated'),
+                excerpt.label('excerpt'),
+                localized('excerpt_more', lang, translated)
+                .label('excerpt_more'),
+                # The content is only needed if there is no excerpt.
+                case([(excerpt == None,
+                       localized('content', lang, translated))])
+                .label('content'),
+                or_(func.coalesce(Post.readmore_sv, '') != '',
+                    func.coalesce(Post.readmore_en, '') != '')
+                .label('readmore'),
+                event_table.c.start_time,
+                event_table.c.location)
+            .select_from(Post)
+            .outerjoin(event_table, event_table.c.id == Post.id))
+
+
+def paginate(query, page, per_page):
+    """Paginate a listing() query into ListingItem records.
+
+    Like Query.paginate(), but the rows are counted without selecting
+    the columns, which Query.count() would do in a subquery.
+    """
+    if page < 1:
+        abort(404)
+
+    items = [ListingItem(*row) for row in
+             query.limit(per_page).offset((page - 1) * per_page)]
+
+    if not items and page != 1:
+        abort(404)
+
+    if page == 1 and len(items) < per_page:
+        total = len(items)
+    else:
+        total = (query.order_by(None)
+                 .with_entities(func.count(Post.id))
+                 .scalar())
+
+    return Pagination(query, page, per_page, total, items)
+
+
+def feed_entries(lang, limit):
+    """Return the latest published posts and events as FeedEntry
+    records, with their content in `lang`.
+    """
+    translated = is_translated(lang)
+    rows = (db.session.query(Post.id,
+                             Post.type,
+                             Post.title,
+                             Post.slug,
+                             Post.timestamp,
+                             translated,
+                             localized('content', lang, translated))
+            .filter(Post.published == True)
+            .order_by(Post.timestamp.desc())
+            .limit(limit))
+
+    entries = []
+    for *columns, translated, content in rows:
+        if content is not None and not translated:
+            content = gettext('(No translation available)\n\n') + content
+        entries.append(FeedEntry(*columns, content))
+
+    return entries
+
+
+def sitemap_entries():
+    """Return all published posts and events as SitemapEntry records,
+    latest first.
+
+    `lastmod` is when the post was last updated, or created if it has
+    not been updated since updated_at was added. The rows are streamed
+    instead of loaded into memory at once.
+    """
+    rows = (db.session.query(Post.id, Post.type, Post.slug,
+                             func.coalesce(Post.updated_at, Post.timestamp))
+            .filter(Post.published == True)
+            .order_by(Post.timestamp.desc())
+            .yield_per(500))
+
+    return (SitemapEntry(*row) for row in rows)
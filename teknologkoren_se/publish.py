@@ -0,0 +1,153 @@
+"""What happens after posts, events and contacts are written.
+
+Changes are collected from every flush and acted on once the
+transaction is committed, whether the write came from the api or
+anywhere else. The caches of all workers are invalidated through the
+bus right away, everything slower runs as background tasks:
+
+- purging the changed pages from the edge cache,
+- when posts or events changed, warming the caches of this worker,
+  regenerating the feeds and sitemaps (see warmer.py). The other
+  workers only drop their caches and fill them on their next
+  requests,
+- pinging the hubs in WEBSUB_HUBS when something published changed,
+  so that feed subscribers are notified.
+"""
+import urllib.parse
+import urllib.request
+from itertools import chain
+from flask import url_for
+from sqlalchemy import event, inspect
+from teknologkoren_se import app
+from teknologkoren_se.cache import bus
+from teknologkoren_se.database import RoutingSession
+from teknologkoren_se.http_cache import purge
+from teknologkoren_se.models import changed_fields, Contact, Event, Post
+from teknologkoren_se.tasks import on_commit
+from teknologkoren_se.warmer import LANGS, warm_after_write
+
+
+def is_or_was_published(post):
+    """Whether a post is published or was before this transaction."""
+    history = inspect(post).attrs.published.history
+    return bool(post.published) or any(history.deleted)
+
+
+# Fields only shown in one language. Changing only these invalidates
+# the pages, feeds and calendars of that language, changing any other
+# field (title, slug, published, ...) invalidates everything listing
+# the post.
+LANG_FIELDS = {
+    'content_sv': 'sv',
+    'readmore_sv': 'sv',
+    'excerpt_sv': 'sv',
+    'excerpt_more_sv': 'sv',
+    'content_en': 'en',
+    'readmore_en': 'en',
+    'excerpt_en': 'en',
+    'excerpt_more_en': 'en',
+}
+
+# A language without a translation shows the other language instead,
+# see Post.content, Post.readmore and Post.excerpt. Changing a field
+# also changes the other language if the field named here is empty in
+# it.
+FALLBACK_FIELDS = {
+    'content': 'content',
+    'excerpt': 'content',
+    'excerpt_more': 'content',
+    'readmore': 'readmore',
+}
+
+
+def changed_langs(post, fields):
+    """Return the lang codes showing any of the changed `fields`."""
+    lang_codes = set()
+
+    for field in fields:
+        lang_code = LANG_FIELDS[field]
+        lang_codes.add(lang_code)
+
+        name = field[:-len('_' + lang_code)]
+        for other in LANGS:
+            fallback = '{}_{}'.format(FALLBACK_FIELDS[name], other)
+            if other != lang_code and not getattr(post, fallback):
+                lang_codes.add(other)
+
+    return lang_codes
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def collect_changes(session, flush_context):
+    changes = session.info.setdefault('changes', {
+        'channels': set(),
+        'keys': set(),
+        'published': False,
+    })
+
+    dirty = [obj for obj in session.dirty if session.is_modified(obj)]
+
+    for obj in chain(session.new, dirty, session.deleted):
+        if isinstance(obj, Contact):
+            changes['channels'].add('contacts')
+            changes['keys'].add('contacts')
+        elif isinstance(obj, Post):
+            channel = 'events' if isinstance(obj, Event) else 'posts'
+            key = 'post-{}'.format(obj.id)
+
+            if obj in dirty:
+                fields = changed_fields(obj) - {'updated_at'}
+            else:
+                fields = None
+
+            if fields is not None and fields <= set(LANG_FIELDS):
+                for lang_code in changed_langs(obj, fields):
+                    changes['channels'].add(
+                        '{}-{}'.format(channel, lang_code))
+                    changes['keys'].update((
+                        '{}:{}'.format(channel, lang_code),
+                        '{}:{}'.format(key, lang_code)))
+            else:
+                changes['channels'].add(channel)
+                changes['keys'].update((channel, key))
+
+            if is_or_was_published(obj):
+                changes['published'] = True
+
+
+# Inserted first, so that it runs before the on_commit tasks are
+# submitted and the tasks see invalidated caches.
+@event.listens_for(RoutingSession, 'after_commit', insert=True)
+def publish_changes(session):
+    changes = session.info.pop('changes', None)
+    if not changes or not changes['channels']:
+        return
+
+    bus.bump(*changes['channels'])
+    on_commit(purge, *changes['keys'], session=session)
+
+    if (app.config['CACHE_WARM_AFTER_WRITES'] and
+            changes['channels'] - {'contacts'}):
+        on_commit(warm_after_write, session=session)
+
+    if changes['published'] and app.config['WEBSUB_HUBS']:
+        on_commit(ping_hubs, session=session)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def drop_changes(session):
+    session.info.pop('changes', None)
+
+
+def ping_hubs():
+    """Tell the WebSub hubs that the feeds have been updated."""
+    with app.test_request_context():
+        feed_urls = [url_for('general.atom_feed', lang_code=lang_code,
+                             _external=True)
+                     for lang_code in LANGS]
+
+    for hub in app.config['WEBSUB_HUBS']:
+        data = urllib.parse.urlencode(
+            [('hub.mode', 'publish')] +
+            [('hub.url', url) for url in feed_urls]).encode()
+        urllib.request.urlopen(hub, data, timeout=10).close()
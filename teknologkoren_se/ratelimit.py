@@ -0,0 +1,147 @@
+"""Token bucket rate limiting of the api, deep archives and widgets.
+
+Every client gets a bucket per limit in RATELIMITS, holding at most
+`burst` tokens and refilled with `rate` tokens per second. A request
+takes a token, a request finding the bucket empty gets a 429 with a
+Retry-After header.
+
+By default the buckets are kept in each worker's memory, so a client
+can make up to a bucket's worth of requests per worker. With
+RATELIMIT_STORAGE set to 'sqlite' the buckets are shared by all
+workers in a SQLite database in CACHE_DIR.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+from teknologkoren_se import app
+
+
+class MemoryBuckets:
+    """Token buckets in memory, private to this process."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, rate, burst):
+        """Take a token from a bucket.
+
+        Returns 0 if a token was taken, otherwise the number of seconds
+        until there is one.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens, wait = refill_and_take(tokens, now - updated, rate, burst)
+            self._buckets[key] = (tokens, now)
+
+        return wait
+
+
+class SQLiteBuckets:
+    """Token buckets in a SQLite database, shared by all workers."""
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS bucket ('
+                               'key TEXT PRIMARY KEY, '
+                               'tokens REAL NOT NULL, '
+                               'updated REAL NOT NULL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def take(self, key, rate, burst):
+        """Take a token from a bucket, see MemoryBuckets.take()."""
+        connection = self._connect()
+        # Wall clock, monotonic clocks are not shared between processes.
+        now = time.time()
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT tokens, updated FROM bucket WHERE key = ?',
+                (key,)).fetchone()
+            tokens, updated = row or (burst, now)
+            tokens, wait = refill_and_take(tokens, max(0, now - updated),
+                                           rate, burst)
+            connection.execute(
+                'INSERT OR REPLACE INTO bucket (key, tokens, updated) '
+                'VALUES (?, ?, ?)', (key, tokens, now))
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+        return wait
+
+
+def refill_and_take(tokens, elapsed, rate, burst):
+    """Return the tokens left after refilling and taking one, and the
+    seconds to wait if there were none to take.
+    """
+    tokens = min(burst, tokens + elapsed * rate)
+
+    if tokens >= 1:
+        return tokens - 1, 0
+
+    return tokens, (1 - tokens) / rate
+
+
+def limit_for_request():
+    """Return the name of the limit that applies to the request, if any."""
+    if request.blueprint == 'api':
+        return 'api'
+
+    # Every widget not in the cache is fetched from Billetto.
+    if request.endpoint == 'events.widgets':
+        return 'widgets'
+
+    # Deep archive pages are rarely visited by humans but expensive,
+    # the pages further back are not cached as well.
+    page = (request.view_args or {}).get('page', 1)
+    if (request.endpoint in ('blog.index', 'events.index', 'events.archive')
+            and page > app.config['RATELIMIT_ARCHIVE_DEPTH']):
+        return 'archive'
+
+    return None
+
+
+def client_address():
+    # nginx overwrites X-Real-IP, it can not be set by the client.
+    return request.headers.get('X-Real-IP', request.remote_addr)
+
+
+if app.config['RATELIMIT_STORAGE'] == 'sqlite':
+    buckets = SQLiteBuckets(os.path.join(app.config['CACHE_DIR'],
+                                         'ratelimit.db'))
+else:
+    buckets = MemoryBuckets()
+
+
+@app.before_request
+def rate_limit():
+    limit = limit_for_request()
+    if limit is None or limit not in app.config['RATELIMITS']:
+        return
+
+    rate, burst = app.config['RATELIMITS'][limit]
+    key = '{}:{}'.format(limit, client_address())
+    wait = buckets.take(key, rate, burst)
+
+    if wait:
+        e = TooManyRequests()
+        e.retry_after = math.ceil(wait)
+        raise e
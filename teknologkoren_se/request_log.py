@@ -0,0 +1,174 @@
+"""Structured request log, a line of json per request.
+
+Every line has the endpoint, lang code, status, the time the request
+took (including rendering a streamed page), how long it spent in the
+database and in how many queries, and whether it was served from one
+of the caches in cache.py ('hit', 'miss', 'coalesced' or null if it
+does not use one). Requests slower than REQUEST_LOG_SLOW seconds are
+logged with their SQL statements and the time each took.
+
+The request thread only puts the record on a queue, it is formatted
+and written by a QueueListener thread, to REQUEST_LOG or, if None, to
+stderr (gunicorn's error log). The log is analysed with e.g. jq:
+
+    jq -s 'group_by(.endpoint)[] | {endpoint: .[0].endpoint,
+           ms: (map(.duration_ms) | add / length)}' requests.log
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from teknologkoren_se import app
+
+# Statements kept per request, for the log of slow requests.
+MAX_STATEMENTS = 100
+
+logger = logging.getLogger('teknologkoren_se.requests')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """Put records on the queue as they are, formatting them is left
+    to the listener's thread.
+    """
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, separators=(',', ':'),
+                          ensure_ascii=False)
+
+
+class RequestLogger:
+    """The queue and the thread writing the log.
+
+    Like TaskQueue, the thread is started by the first request in
+    every process, gunicorn's workers do not inherit the master's
+    threads.
+    """
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            path = app.config['REQUEST_LOG']
+            if path:
+                handler = logging.handlers.WatchedFileHandler(path)
+            else:
+                handler = logging.StreamHandler(sys.stderr)
+            handler.setFormatter(JsonFormatter())
+
+            records = queue.Queue()
+            logger.handlers = [RecordQueueHandler(records)]
+            self._listener = logging.handlers.QueueListener(records, handler)
+            self._listener.start()
+            atexit.register(self._listener.stop)
+            self._pid = os.getpid()
+
+    def log(self, line):
+        if self._pid != os.getpid():
+            self._start()
+
+        logger.info(line)
+
+
+request_logger = RequestLogger()
+
+
+class RequestRecord:
+    __slots__ = ('start', 'db_seconds', 'queries', 'statements')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.statements = []
+
+
+def start_request_record():
+    if app.config['REQUEST_LOGGING']:
+        g.request_record = RequestRecord()
+
+
+# First, so that the other hooks are timed too.
+app.before_request_funcs.setdefault(None, []).insert(0, start_request_record)
+
+
+@app.after_request
+def log_request(response):
+    record = g.get('request_record')
+    if record is None:
+        return response
+
+    line = {
+        'time': datetime.utcnow().isoformat(timespec='milliseconds') + 'Z',
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'lang': g.get('lang_code'),
+        'status': response.status_code,
+    }
+    # The request context might be gone when the response is closed,
+    # but a streamed page is rendered with the same g.
+    request_g = g._get_current_object()
+
+    # Logged once the response is sent, a streamed page is rendered
+    # after this hook.
+    def finish():
+        line['cache'] = request_g.get('cache_status')
+        duration = time.perf_counter() - record.start
+        line['duration_ms'] = round(duration * 1000, 2)
+        line['db_ms'] = round(record.db_seconds * 1000, 2)
+        line['queries'] = record.queries
+
+        if duration >= app.config['REQUEST_LOG_SLOW']:
+            line['slow'] = True
+            line['statements'] = [
+                {'sql': statement, 'ms': round(seconds * 1000, 2)}
+                for statement, seconds in record.statements]
+
+        request_logger.log(line)
+
+    response.call_on_close(finish)
+    return response
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context,
+                      executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context,
+                     executemany):
+    seconds = time.perf_counter() - conn.info['query_start'].pop()
+
+    if not has_request_context():
+        return
+
+    record = g.get('request_record')
+    if record is None:
+        return
+
+    record.db_seconds += seconds
+    record.queries += 1
+    if len(record.statements) < MAX_STATEMENTS:
+        record.statements.append((statement, seconds))
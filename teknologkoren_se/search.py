@@ -0,0 +1,152 @@
+"""Full-text search over posts and events.
+
+On SQLite, posts are indexed by FTS5 in one external-content table per
+language. Only the index is stored in these tables, the text is read
+from the post table when needed (for snippets). Swedish is tokenized
+as is, so that å, ä and ö are not folded into a and o, while English
+is stemmed with the porter tokenizer ("concerts" matches "concert").
+
+Triggers on the post table keep the indices in sync with every write,
+whether it is made through the api or directly in the database. Other
+databases fall back to a slower LIKE search without ranking.
+"""
+import re
+from collections import namedtuple
+from markupsafe import escape, Markup
+from sqlalchemy import DateTime, DDL, event, Integer, or_, String, text
+from teknologkoren_se import db
+from teknologkoren_se.models import Post
+
+TOKENIZERS = {
+    'sv': 'unicode61 remove_diacritics 0',
+    'en': 'porter unicode61',
+}
+
+# Markers for highlighted terms in snippets, replaced with <mark>
+# after escaping the snippet.
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+SearchResult = namedtuple('SearchResult',
+                          ['id', 'type', 'title', 'slug', 'timestamp',
+                           'snippet'])
+
+
+def fts_ddl(lang):
+    """Return the statements creating the index for a language."""
+    table = 'post_fts_{}'.format(lang)
+    columns = 'title, content_{0}, readmore_{0}'.format(lang)
+    new_values = 'new.id, new.title, new.content_{0}, new.readmore_{0}'.format(
+        lang)
+    old_values = 'old.id, old.title, old.content_{0}, old.readmore_{0}'.format(
+        lang)
+
+    return [
+        "CREATE VIRTUAL TABLE {table} USING fts5({columns}, "
+        "content='post', content_rowid='id', tokenize='{tokenize}')"
+        .format(table=table, columns=columns, tokenize=TOKENIZERS[lang]),
+
+        "CREATE TRIGGER {table}_ai AFTER INSERT ON post BEGIN "
+        "INSERT INTO {table}(rowid, {columns}) VALUES ({new}); END"
+        .format(table=table, columns=columns, new=new_values),
+
+        "CREATE TRIGGER {table}_ad AFTER DELETE ON post BEGIN "
+        "INSERT INTO {table}({table}, rowid, {columns}) "
+        "VALUES ('delete', {old}); END"
+        .format(table=table, columns=columns, old=old_values),
+
+        "CREATE TRIGGER {table}_au AFTER UPDATE ON post BEGIN "
+        "INSERT INTO {table}({table}, rowid, {columns}) "
+        "VALUES ('delete', {old}); "
+        "INSERT INTO {table}(rowid, {columns}) VALUES ({new}); END"
+        .format(table=table, columns=columns, old=old_values,
+                new=new_values),
+    ]
+
+
+# Create the indices together with the post table, e.g. in `manage.py
+# create_db`. Existing databases get them through a migration.
+for lang in TOKENIZERS:
+    for statement in fts_ddl(lang):
+        event.listen(Post.__table__, 'after_create',
+                     DDL(statement).execute_if(dialect='sqlite'))
+
+
+def match_expression(query):
+    """Turn user input into a safe FTS5 query.
+
+    Every word is quoted, so that FTS5 syntax in the input is searched
+    for instead of interpreted, and matched as a prefix. All words have
+    to match.
+    """
+    words = re.findall(r'\w+', query)
+    return ' '.join('"{}"*'.format(word) for word in words)
+
+
+def highlight(snippet):
+    """Escape a snippet and turn the match markers into <mark>."""
+    if snippet is None:
+        return None
+
+    return Markup(str(escape(snippet))
+                  .replace(_MARK_START, '<mark>')
+                  .replace(_MARK_END, '</mark>'))
+
+
+def search(query, lang, limit=20):
+    """Return published posts and events matching `query`, best first.
+
+    Results are SearchResult tuples, the snippet is safe html with the
+    matching terms in <mark>.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+
+    if db.session.get_bind().dialect.name != 'sqlite':
+        return _like_search(query, lang, limit)
+
+    table = 'post_fts_{}'.format(lang)
+
+    # bm25() weights are per column: title, content, readmore. The
+    # snippet is taken from whichever column matches best.
+    statement = text(
+        "SELECT post.id AS id, post.type AS type, post.title AS title, "
+        "post.slug AS slug, post.timestamp AS timestamp, "
+        "snippet({table}, -1, :start, :end, '…', 16) AS snippet "
+        "FROM {table} JOIN post ON post.id = {table}.rowid "
+        "WHERE {table} MATCH :expression AND post.published "
+        "ORDER BY bm25({table}, 10.0, 2.0, 1.0) "
+        "LIMIT :limit".format(table=table)
+    ).columns(id=Integer, type=String, title=String, slug=String,
+              timestamp=DateTime, snippet=String)
+
+    rows = db.session.execute(statement, {
+        'start': _MARK_START,
+        'end': _MARK_END,
+        'expression': expression,
+        'limit': limit,
+    })
+
+    return [SearchResult(*row[:5], highlight(row[5])) for row in rows]
+
+
+def _like_search(query, lang, limit):
+    """Fallback for databases without FTS5, newest first."""
+    # The query is matched literally, not as a pattern.
+    escaped = (query.replace('\\', '\\\\')
+               .replace('%', '\\%')
+               .replace('_', '\\_'))
+    pattern = '%{}%'.format(escaped)
+    content = getattr(Post, 'content_{}'.format(lang))
+
+    posts = (Post.query
+             .filter(Post.published == True,
+                     or_(Post.title.ilike(pattern, escape='\\'),
+                         content.ilike(pattern, escape='\\')))
+             .order_by(Post.timestamp.desc())
+             .limit(limit))
+
+    return [SearchResult(post.id, post.type, post.title, post.slug,
+                         post.timestamp, None)
+            for post in posts]
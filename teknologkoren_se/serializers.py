@@ -0,0 +1,64 @@
+"""Encoding of api responses.
+
+The api responds with json, or with MessagePack to clients sending
+`Accept: application/msgpack` if msgpack is installed. If orjson is
+installed it is used to encode json, which is several times faster
+than the standard library, otherwise json is used.
+
+All datetimes are encoded as ISO 8601 strings without a timezone,
+e.g. `2018-05-01T19:00:00`, in every format.
+"""
+import json
+from datetime import datetime
+from flask import request, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def default(obj):
+    """Encode objects the encoders do not know about."""
+    if isinstance(obj, datetime):
+        return obj.strftime(DATETIME_FORMAT)
+    raise TypeError('{!r} is not serializable'.format(obj))
+
+
+def dumps_json(data):
+    """Return data encoded as json (bytes)."""
+    if orjson is not None:
+        # orjson encodes datetimes itself (with microseconds), pass
+        # them to default() to encode them like everywhere else.
+        return orjson.dumps(data, default=default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+    return json.dumps(data, default=default,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def dumps_msgpack(data):
+    """Return data encoded as MessagePack."""
+    return msgpack.packb(data, default=default, use_bin_type=True)
+
+
+ENCODERS = {'application/json': dumps_json}
+if msgpack is not None:
+    ENCODERS['application/msgpack'] = dumps_msgpack
+
+
+def serialize(data, status=200):
+    """Return data as a response in the format the client prefers."""
+    mimetype = request.accept_mimetypes.best_match(
+        ENCODERS, default='application/json')
+
+    response = Response(ENCODERS[mimetype](data), status, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
@@ -1,20 +1,88 @@
-function init_widget (widget) {
-  var id = widget.id.substring(16);  // Everything after "billetto_widget_"
-  console.log(id);
+// Billetto ticket widgets are fetched through the site, which caches
+// them (see widgets.py), when they scroll into view. Widgets coming
+// into view together are fetched in one request.
+
+var WIDGET_PREFIX = "billetto_widget_";
+var MAX_WIDGETS = 20;  // Same as in views/events.py
+
+// Widget elements by id, a widget can be on a page more than once.
+var pending = {};
+var pending_count = 0;  // Ids in pending
+var pending_timer = null;
+
+function widgets_url (ids) {
+  var lang = document.documentElement.lang.substring(0, 2) || "sv";
+  var query = ids.map(function (id) {
+    return "id=" + encodeURIComponent(id);
+  }).join("&");
+  return "/" + lang + "/konserter/biljetter/?" + query;
+}
+
+function load_widgets () {
+  var batch = pending;
+  var ids = Object.keys(batch);
+  pending = {};
+  pending_count = 0;
+  pending_timer = null;
+
   var xhr = new XMLHttpRequest();
-  xhr.open("GET", "https://billetto.se/e/" + id + "/widget_new?theme=white", true );
+  xhr.open("GET", widgets_url(ids), true);
   xhr.onload = function (e) {
-    if ( xhr.readyState == 4 && (xhr.status == 200 || xhr.status == 304) ) {
-      widget.innerHTML = xhr.responseText;
+    if (xhr.readyState == 4 && (xhr.status == 200 || xhr.status == 304)) {
+      var widgets = JSON.parse(xhr.responseText);
+      ids.forEach(function (id) {
+        if (widgets[id]) {
+          batch[id].forEach(function (widget) {
+            widget.innerHTML = widgets[id];
+          });
+        }
+      });
     }
   };
   xhr.send(null);
 }
 
+function queue_widget (widget) {
+  var id = widget.id.substring(WIDGET_PREFIX.length);
+
+  if (pending.hasOwnProperty(id)) {
+    pending[id].push(widget);
+    return;
+  }
+
+  pending[id] = [widget];
+  pending_count++;
+
+  if (pending_count >= MAX_WIDGETS) {
+    clearTimeout(pending_timer);
+    load_widgets();
+  } else if (pending_timer === null) {
+    // Wait for the other widgets coming into view at the same time.
+    pending_timer = setTimeout(load_widgets, 50);
+  }
+}
+
 function init_widgets () {
-  var widgets = document.querySelectorAll('*[id^=billetto_widget_]');
+  var widgets = document.querySelectorAll('*[id^=' + WIDGET_PREFIX + ']');
+
+  if (!("IntersectionObserver" in window)) {
+    for (var i = 0; i < widgets.length; i++) {
+      queue_widget(widgets[i]);
+    }
+    return;
+  }
+
+  var observer = new IntersectionObserver(function (entries) {
+    entries.forEach(function (entry) {
+      if (entry.isIntersecting) {
+        observer.unobserve(entry.target);
+        queue_widget(entry.target);
+      }
+    });
+  }, {rootMargin: "200px"});
+
   for (var i = 0; i < widgets.length; i++) {
-    init_widget(widgets[i]);
+    observer.observe(widgets[i]);
   }
 }
 
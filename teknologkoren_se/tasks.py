@@ -0,0 +1,139 @@
+"""Background tasks run after a database commit.
+
+Work that follows a write, e.g. purging caches or pinging WebSub hubs,
+should not make the api request wait. on_commit() schedules a task to
+run once the current transaction is committed (and drops it if it is
+rolled back). Committed tasks are handed to a bounded pool of
+background threads.
+
+A failing task is retried TASKS_RETRIES times with exponential
+backoff. If it still fails, or the queue is full, it is written to the
+dead-letter log as a line of json. With TASKS_SYNCHRONOUS (e.g. in
+tests) the commit instead waits until its tasks, retries included,
+are done.
+"""
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime
+from sqlalchemy import event
+from teknologkoren_se import app, db
+from teknologkoren_se.database import RoutingSession
+
+
+class TaskQueue:
+    """A bounded queue of tasks and the threads running them.
+
+    The threads are started on the first submit in every process, so
+    that a queue created before gunicorn forks its workers still works
+    in the workers.
+    """
+    def __init__(self):
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            self._queue = queue.Queue(app.config['TASKS_QUEUE_SIZE'])
+            for _ in range(app.config['TASKS_WORKERS']):
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, func, *args, **kwargs):
+        """Run `func(*args, **kwargs)` in the background."""
+        task = (func, args, kwargs)
+
+        if app.config['TASKS_SYNCHRONOUS']:
+            # Still in a thread of its own, the committing session
+            # cannot be used until the commit has finished.
+            thread = threading.Thread(target=self.run, args=(task,))
+            thread.start()
+            thread.join()
+            return
+
+        if self._pid != os.getpid():
+            self._start()
+
+        try:
+            self._queue.put_nowait(task)
+        except queue.Full:
+            dead_letter(task, 'Task queue full')
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            try:
+                self.run(task)
+            finally:
+                self._queue.task_done()
+
+    def run(self, task):
+        """Run a task in an app context, retrying it if it fails."""
+        func, args, kwargs = task
+        retries = app.config['TASKS_RETRIES']
+
+        for attempt in range(retries + 1):
+            try:
+                with app.app_context():
+                    func(*args, **kwargs)
+                return
+            except Exception:
+                if attempt == retries:
+                    dead_letter(task, traceback.format_exc())
+                    return
+
+                app.logger.warning('Task %s failed, retrying',
+                                   func.__qualname__, exc_info=True)
+                time.sleep(app.config['TASKS_RETRY_DELAY'] * 2 ** attempt)
+
+    def join(self):
+        """Wait until every submitted task is done."""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+
+def dead_letter(task, error):
+    """Log a task that could not be run."""
+    func, args, kwargs = task
+    app.logger.error('Task %s failed: %s', func.__qualname__, error)
+
+    entry = {
+        'time': datetime.utcnow().isoformat(),
+        'task': '{}.{}'.format(func.__module__, func.__qualname__),
+        'args': [repr(arg) for arg in args],
+        'kwargs': {key: repr(value) for key, value in kwargs.items()},
+        'error': error,
+    }
+
+    path = app.config['TASKS_DEAD_LETTER_LOG']
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+tasks = TaskQueue()
+
+
+def on_commit(func, *args, session=None, **kwargs):
+    """Run a task after the session's transaction is committed."""
+    session = session or db.session()
+    session.info.setdefault('on_commit', []).append((func, args, kwargs))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def submit_committed_tasks(session):
+    for func, args, kwargs in session.info.pop('on_commit', []):
+        tasks.submit(func, *args, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def drop_rolled_back_tasks(session):
+    session.info.pop('on_commit', None)
@@ -0,0 +1,116 @@
+"""Streaming image uploads, deduplicated by content.
+
+Uploaded files are written to a temporary file in the upload folder
+while the request body is parsed, hashing the content on the way, so
+an upload is never held in memory and is read only once. The
+temporary file is then renamed into place, or removed if an image with
+the same content has been uploaded before.
+
+Uploads larger than MAX_CONTENT_LENGTH (16 MiB unless configured) are
+refused with a 413.
+"""
+import hashlib
+import os
+import tempfile
+from flask import Request
+from flask_uploads import UploadNotAllowed
+from sqlalchemy.exc import IntegrityError
+from teknologkoren_se import app, db, images
+from teknologkoren_se.models import Image
+
+
+class HashingFile:
+    """A temporary file computing the sha256 of what is written to it."""
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=directory,
+                                                prefix='.upload-',
+                                                delete=False)
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.file.name):
+            os.remove(self.file.name)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class UploadRequest(Request):
+    """Request streaming image uploads to HashingFiles."""
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        if self.endpoint == 'api.upload_image':
+            return HashingFile(images.config.destination)
+
+        return super()._get_file_stream(total_content_length, content_type,
+                                        filename, content_length)
+
+
+def save_image(storage):
+    """Save an uploaded image, unless it has been uploaded before.
+
+    Returns the filename of the image. Raises UploadNotAllowed if it
+    does not have an image extension.
+    """
+    stream = storage.stream
+    if not isinstance(stream, HashingFile):
+        # Not parsed by UploadRequest, copy it to one.
+        stream = HashingFile(images.config.destination)
+        storage.save(stream)
+
+    try:
+        basename = images.get_basename(storage.filename)
+        if not images.file_allowed(storage, basename):
+            raise UploadNotAllowed()
+
+        existing = existing_image(stream.hash.hexdigest())
+        if existing is not None:
+            return existing
+
+        stream.file.close()
+        # NamedTemporaryFile is only readable by us, not by nginx.
+        os.chmod(stream.name, 0o644)
+
+        if os.path.exists(images.path(basename)):
+            basename = images.resolve_conflict(images.config.destination,
+                                               basename)
+        os.rename(stream.name, images.path(basename))
+
+        db.session.add(Image(filename=basename,
+                             sha256=stream.hash.hexdigest()))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Uploaded at the same time by someone else, keep theirs.
+            db.session.rollback()
+            os.remove(images.path(basename))
+            return existing_image(stream.hash.hexdigest())
+
+        return basename
+    finally:
+        stream.discard()
+
+
+def existing_image(sha256):
+    """Return the filename of a saved image with the hash, if any."""
+    image = Image.query.filter_by(sha256=sha256).first()
+
+    if image is None:
+        return None
+
+    if not os.path.exists(images.path(image.filename)):
+        # Removed from disk, upload it anew.
+        db.session.delete(image)
+        db.session.commit()
+        return None
+
+    return image.filename
+
+
+app.request_class = UploadRequest
@@ -1,5 +1,6 @@
 from urllib.parse import urlparse, urljoin
-from flask import g, request, session, url_for
+from flask import g, get_flashed_messages, render_template, request, \
+        Response, session, stream_with_context, url_for
 from teknologkoren_se import app
 
 
@@ -15,6 +16,60 @@ def paginate(content, page, page_size):
     return pagination
 
 
+def stream_template(template_name, **context):
+    """Render a template as a streamed response.
+
+    Drop-in replacement for render_template() for pages that take a
+    while to render. The page is sent as it is rendered: everything up
+    to and including </head> is flushed at once, so that the browser
+    can fetch the stylesheet while the rest of the page renders, and
+    after that in chunks of STREAM_BUFFER_SIZE characters.
+
+    nginx is told not to buffer the response with X-Accel-Buffering.
+    Headers are sent before the body is rendered, so an error while
+    rendering cuts the response short instead of returning a 500.
+
+    Falls back to render_template() if STREAM_TEMPLATES is disabled.
+    """
+    if not app.config['STREAM_TEMPLATES']:
+        return render_template(template_name, **context)
+
+    # Flashed messages are popped from the session when the template
+    # asks for them, which would be after the session cookie is sent.
+    # Popping them now caches them for the template.
+    get_flashed_messages()
+
+    app.update_template_context(context)
+    template = app.jinja_env.get_or_select_template(template_name)
+    buffer_size = app.config['STREAM_BUFFER_SIZE']
+
+    def generate():
+        buffer = []
+        size = 0
+        head_sent = False
+
+        for chunk in template.generate(context):
+            buffer.append(chunk)
+            size += len(chunk)
+
+            if head_sent:
+                flush = size >= buffer_size
+            else:
+                flush = head_sent = '</head>' in chunk
+
+            if flush:
+                yield ''.join(buffer)
+                buffer = []
+                size = 0
+
+        if buffer:
+            yield ''.join(buffer)
+
+    response = Response(stream_with_context(generate()))
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def url_for_other_page(page):
     """Return url for a page number."""
     args = request.view_args.copy()
@@ -62,6 +117,10 @@ def bp_url_processors(bp):
         lang_code = values.pop('lang_code')
 
         if lang_code in ('sv', 'en'):
-            # Valid lang_code, set the global lang_code and cookie
+            # Valid lang_code, set the global lang_code. The lang code
+            # is explicit in the url, so no cookie is set: responses
+            # with cookies cannot be cached by nginx. The cookie read
+            # for paths without lang code is only set when switching
+            # language, by general.set_lang.
             g.lang_code = lang_code
-            session['lang_code'] = g.lang_code
+            g.lang_from_url = True
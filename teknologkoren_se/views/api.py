@@ -1,7 +1,12 @@
 import datetime
-from flask import abort, Blueprint, jsonify, request, url_for
+from flask import abort, Blueprint, request, url_for
+from flask_uploads import UploadNotAllowed
 from teknologkoren_se import token_auth, db, images
-from teknologkoren_se.models import Post, Event, Contact
+from teknologkoren_se.changes import changes_since
+from teknologkoren_se.models import changed_fields, Post, Event, Contact
+from teknologkoren_se.search import search as search_posts
+from teknologkoren_se.serializers import DATETIME_FORMAT, serialize
+from teknologkoren_se.uploads import save_image
 
 
 mod = Blueprint('api', __name__, url_prefix='/api')
@@ -61,6 +66,44 @@ def get_new_data(fields):
     return data
 
 
+def get_patch_data(fields):
+    """Validate and return PATCHed data.
+
+    Like get_new_data(), but only the fields to change are sent.
+    """
+    data = request.get_json()
+    if not isinstance(data, dict) or not data:
+        abort(400)
+
+    if not all(key in fields and isinstance(value, fields[key])
+               for key, value in data.items()):
+        abort(400)
+
+    if not all(value for value in data.values() if isinstance(value, str)):
+        abort(400)
+
+    return data
+
+
+def apply_patch(post, data):
+    """Write PATCHed data to a post or event and respond with it.
+
+    The response lists the fields that actually changed in `changed`,
+    e.g. a new title also changes the slug. Nothing is committed if
+    nothing changed, so no caches are invalidated.
+    """
+    for key, value in data.items():
+        setattr(post, key, value)
+
+    changed = changed_fields(post)
+    if changed:
+        db.session.commit()
+
+    response = make_post_dict(post)
+    response['changed'] = sorted(changed)
+    return serialize(response)
+
+
 # ----- POSTS ----- #
 
 POST_FIELDS = {
@@ -82,7 +125,7 @@ def get_posts():
     """
     posts = Post.query.filter_by(type='post')
     response = [make_post_dict(post) for post in posts]
-    return jsonify(response)
+    return serialize(response)
 
 
 @mod.route('/posts/<int:post_id>', methods=['GET'])
@@ -96,7 +139,7 @@ def get_post(post_id):
     post = Post.query.filter_by(type='post', id=post_id).one_or_none()
     if post:
         response = make_post_dict(post)
-        return jsonify(response)
+        return serialize(response)
     abort(404)
 
 
@@ -113,7 +156,7 @@ def new_post():
     db.session.commit()
 
     response = make_post_dict(post)
-    return jsonify(response), 201
+    return serialize(response, 201)
 
 
 @mod.route('/posts/<int:post_id>', methods=['PUT'])
@@ -136,7 +179,18 @@ def update_post(post_id):
     db.session.commit()
 
     response = make_post_dict(post)
-    return jsonify(response)
+    return serialize(response)
+
+
+@mod.route('/posts/<int:post_id>', methods=['PATCH'])
+def patch_post(post_id):
+    """Update some fields of a post.
+
+    Only the supplied fields are validated and written.
+    """
+    post = Post.query.filter_by(type='post', id=post_id).first_or_404()
+    data = get_patch_data(POST_FIELDS)
+    return apply_patch(post, data)
 
 
 @mod.route('/posts/<int:post_id>', methods=['DELETE'])
@@ -165,6 +219,21 @@ EVENT_FIELDS = {
 }
 
 
+def parse_start_time(value):
+    """Parse a start time, with or without seconds.
+
+    Start times are returned with seconds (see serializers.py) but
+    datetime-local inputs send them without.
+    """
+    for fmt in (DATETIME_FORMAT, '%Y-%m-%dT%H:%M'):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+
+    abort(400, 'Invalid start_time')
+
+
 @mod.route('/events', methods=['GET'])
 def get_events():
     """Get all events.
@@ -173,7 +242,7 @@ def get_events():
     """
     events = Event.query.all()
     response = [make_post_dict(event) for event in events]
-    return jsonify(response)
+    return serialize(response)
 
 
 @mod.route('/events/<int:event_id>', methods=['GET'])
@@ -184,7 +253,7 @@ def get_event(event_id):
     """
     event = Event.query.get_or_404(event_id)
     response = make_post_dict(event)
-    return jsonify(response)
+    return serialize(response)
 
 
 @mod.route('/events', methods=['POST'])
@@ -194,15 +263,14 @@ def new_event():
     Field requirements are defined with get_new_data().
     """
     data = get_new_data(EVENT_FIELDS)
-    data['start_time'] = datetime.datetime.strptime(data['start_time'],
-                                                    '%Y-%m-%dT%H:%M')
+    data['start_time'] = parse_start_time(data['start_time'])
     event = Event(**data)
     event.timestamp = datetime.datetime.utcnow()
     db.session.add(event)
     db.session.commit()
 
     response = make_post_dict(event)
-    return jsonify(response)
+    return serialize(response)
 
 
 @mod.route('/events/<int:event_id>', methods=['PUT'])
@@ -215,8 +283,7 @@ def update_event(event_id):
     event = Event.query.get_or_404(event_id)
 
     data = get_new_data(EVENT_FIELDS)
-    data['start_time'] = datetime.datetime.strptime(data['start_time'],
-                                                    '%Y-%m-%dT%H:%M')
+    data['start_time'] = parse_start_time(data['start_time'])
     event.title = data['title']
     event.content_sv = data['content_sv']
     event.content_en = data['content_en']
@@ -229,7 +296,20 @@ def update_event(event_id):
     db.session.commit()
 
     response = make_post_dict(event)
-    return jsonify(response)
+    return serialize(response)
+
+
+@mod.route('/events/<int:event_id>', methods=['PATCH'])
+def patch_event(event_id):
+    """Update some fields of an event.
+
+    Only the supplied fields are validated and written.
+    """
+    event = Event.query.get_or_404(event_id)
+    data = get_patch_data(EVENT_FIELDS)
+    if 'start_time' in data:
+        data['start_time'] = parse_start_time(data['start_time'])
+    return apply_patch(event, data)
 
 
 @mod.route('/events/<int:event_id>', methods=['DELETE'])
@@ -243,16 +323,91 @@ def delete_event(event_id):
 # ----- END EVENTS ----- #
 
 
+@mod.route('/search', methods=['GET'])
+def search():
+    """Search published posts and events.
+
+    Query parameters are `q`, the search terms, `lang` ('sv' or 'en',
+    default 'sv') and `limit` (default 20). Returns a jsonified list of
+    results, best match first, with html snippets of the matching text.
+    """
+    query = request.args.get('q', '').strip()
+    lang = request.args.get('lang', 'sv')
+    limit = request.args.get('limit', 20, type=int)
+
+    if not query or lang not in ('sv', 'en') or not 0 < limit <= 100:
+        abort(400)
+
+    response = []
+    for result in search_posts(query, lang, limit):
+        if result.type == 'event':
+            uri = url_for('.get_event', event_id=result.id)
+        else:
+            uri = url_for('.get_post', post_id=result.id)
+
+        response.append({
+            'id': result.id,
+            'type': result.type,
+            'title': result.title,
+            'slug': result.slug,
+            'timestamp': result.timestamp,
+            'snippet': result.snippet,
+            'uri': uri,
+        })
+
+    return serialize(response)
+
+
+@mod.route('/changes', methods=['GET'])
+def get_changes():
+    """Get posts and events changed since a cursor.
+
+    `since` is the cursor returned by the previous call, leave it out
+    (or use 0) to get everything. Deleted posts and events are
+    returned with `deleted` set and no `post`. If `more` is true, there
+    are more changes than `limit`, call again with the new cursor.
+    """
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', 100, type=int)
+
+    if since < 0 or not 0 < limit <= 500:
+        abort(400)
+
+    changes = changes_since(since, limit + 1)
+    more = len(changes) > limit
+    changes = changes[:limit]
+
+    response = {
+        'changes': [{
+            'cursor': change.id,
+            'type': change.type,
+            'id': change.object_id,
+            'deleted': change.deleted,
+            'changed_at': change.changed_at,
+            'post': make_post_dict(post) if post else None,
+        } for change, post in changes],
+        'cursor': changes[-1][0].id if changes else since,
+        'more': more,
+    }
+
+    return serialize(response)
+
+
 @mod.route('/images', methods=['POST'])
 def upload_image():
     """Upload a image.
 
-    Returns image info jsonified.
+    If the same image has been uploaded before, the existing image is
+    used instead. Returns image info jsonified.
     """
     if 'image' in request.files:
-        filename = images.save(request.files['image'])
+        try:
+            filename = save_image(request.files['image'])
+        except UploadNotAllowed:
+            abort(400, 'Not an image')
+
         response = {"filename": filename, "path": images.url(filename)}
-        return jsonify(response)
+        return serialize(response)
 
     abort(400)
 
@@ -260,7 +415,7 @@ def upload_image():
 @mod.route('/contact', methods=['GET'])
 def get_contacts():
     contacts = [c.to_dict() for c in Contact.query.all()]
-    return jsonify(contacts)
+    return serialize(contacts)
 
 
 @mod.route('/contact', methods=['POST'])
@@ -275,9 +430,15 @@ def new_contact():
     }
     data = get_new_data(fields)
     contact = Contact(**data)
+
+    # The number is formatted when set, an unformattable number is
+    # not a valid phone number.
+    if contact.phone and not contact.formatted_phone:
+        abort(400, 'Invalid phone number')
+
     db.session.add(contact)
     db.session.commit()
-    return jsonify(contact.to_dict())
+    return serialize(contact.to_dict())
 
 
 @mod.route('/contact/<int:contact_id>', methods=['DELETE'])
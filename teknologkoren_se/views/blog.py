@@ -1,8 +1,12 @@
-from flask import abort, Blueprint, flash, redirect, render_template, url_for
+from flask import abort, Blueprint, flash, g, redirect, render_template, \
+        request, url_for
 from flask_babel import gettext
-from teknologkoren_se import app, images
-from teknologkoren_se.models import Post, Event
-from teknologkoren_se.util import url_for_other_page, bp_url_processors
+from teknologkoren_se import app, images, projections
+from teknologkoren_se.cache import coalesce
+from teknologkoren_se.models import Post
+from teknologkoren_se.search import search as search_posts
+from teknologkoren_se.util import url_for_other_page, bp_url_processors, \
+        stream_template
 
 
 mod = Blueprint('blog', __name__, url_prefix='/<any(sv, en):lang_code>')
@@ -11,13 +15,11 @@ bp_url_processors(mod)
 
 
 def is_event(post):
-    """Check whether an object is of Event type.
+    """Check whether a post, or its projection, is an event.
 
     Used by templates as posts and events are in the same list.
     """
-    if isinstance(post, Event):
-        return True
-    return False
+    return post.type == 'event'
 
 
 def image_destination():
@@ -38,12 +40,29 @@ def index(page):
     Event is a subclass of Post, querying Post returns both events and
     posts.
     """
-    posts = (Post.query.filter_by(published=True)
+    if page == 1:
+        return first_page()
+
+    return overview(page)
+
+
+@coalesce
+def first_page():
+    """Render the first page, once for concurrent requests.
+
+    Right after publishing, it is requested by many at once.
+    """
+    return overview(1)
+
+
+def overview(page):
+    posts = (projections.listing(g.lang_code)
+             .filter(Post.published == True)
              .order_by(Post.timestamp.desc()))
 
-    pagination = posts.paginate(page, 5)
+    pagination = projections.paginate(posts, page, 5)
 
-    return render_template('blog/overview.html',
+    return stream_template('blog/overview.html',
                            pagination=pagination,
                            page=page)
 
@@ -62,3 +81,14 @@ def view_post(post_id, slug=None):
         return redirect(url_for('.view_post', post_id=post.id, slug=post.slug))
 
     return render_template('blog/view-post.html', post=post)
+
+
+@mod.route('/sok/')
+def search():
+    """Search published posts and events."""
+    query = request.args.get('q', '').strip()
+    results = search_posts(query, g.lang_code) if query else []
+
+    return render_template('blog/search.html',
+                           query=query,
+                           results=results)
@@ -1,4 +1,4 @@
-from flask import jsonify, render_template, request
+from flask import jsonify, make_response, render_template, request
 from jinja2.exceptions import TemplateNotFound
 from teknologkoren_se import app
 
@@ -8,6 +8,7 @@ from teknologkoren_se import app
 @app.errorhandler(404)
 @app.errorhandler(405)
 @app.errorhandler(409)
+@app.errorhandler(413)
 def handle_error(e):
     if request.path.startswith('/api'):
         # The api should not return html
@@ -17,6 +18,8 @@ def handle_error(e):
                 404: {'error': 'Not Found'},
                 405: {'error': 'Method Not Allowed'},
                 409: {'error': 'Conflict'},
+                413: {'error': 'Request Entity Too Large'},
+                429: {'error': 'Too Many Requests'},
                 }
         response = api_response[e.code]
         response['message'] = e.description
@@ -31,6 +34,18 @@ def handle_error(e):
         return response, e.code
 
 
+@app.errorhandler(429)
+def handle_too_many_requests(e):
+    """Handle rate limited requests, see ratelimit.py."""
+    response = make_response(handle_error(e))
+
+    retry_after = getattr(e, 'retry_after', None)
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+
+    return response
+
+
 @app.errorhandler(500)
 def handle_server_error(e):
     """Handle Internal Server Errors.
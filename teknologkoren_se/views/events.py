@@ -1,9 +1,14 @@
 from datetime import datetime, timedelta
-from flask import abort, Blueprint, redirect, render_template, url_for
-from teknologkoren_se import app, images
+from flask import abort, Blueprint, g, jsonify, redirect, render_template, \
+        request, url_for
+from flask_babel import gettext
+from teknologkoren_se import app, images, ical, projections
+from teknologkoren_se.cache import CachedDocument
 from teknologkoren_se.models import Event
 from teknologkoren_se.util import url_for_other_page, \
-        bp_url_processors
+        bp_url_processors, stream_template
+from teknologkoren_se.widgets import embedded, WIDGET_ID, \
+        widgets as widget_cache
 
 
 mod = Blueprint('events',
@@ -16,6 +21,12 @@ bp_url_processors(mod)
 app.jinja_env.globals['url_for_other_page'] = url_for_other_page
 app.jinja_env.globals['image_url'] = images.url
 
+# Events have no end time, calendars get this as their duration.
+EVENT_DURATION = 'PT2H'
+
+# Most ticket widgets fetched in one request.
+MAX_WIDGETS = 20
+
 
 @mod.route('/', defaults={'page': 1})
 @mod.route('/page/<int:page>/')
@@ -27,13 +38,13 @@ def index(page):
     event.
     """
     old = datetime.utcnow() - timedelta(hours=12)
-    events = (Event.query
+    events = (projections.listing(g.lang_code)
               .filter(Event.start_time > old, Event.published == True)
               .order_by(Event.start_time.asc()))
 
-    pagination = events.paginate(page, 5)
+    pagination = projections.paginate(events, page, 5)
 
-    return render_template('events/coming.html',
+    return stream_template('events/coming.html',
                            pagination=pagination,
                            page=page)
 
@@ -47,13 +58,13 @@ def archive(page):
     3 hours since the start time of the event.
     """
     old = datetime.utcnow() - timedelta(hours=12)
-    events = (Event.query
+    events = (projections.listing(g.lang_code)
               .filter(Event.start_time < old, Event.published == True)
               .order_by(Event.start_time.desc()))
 
-    pagination = events.paginate(page, 5)
+    pagination = projections.paginate(events, page, 5)
 
-    return render_template('events/archive.html',
+    return stream_template('events/archive.html',
                            pagination=pagination,
                            page=page)
 
@@ -75,3 +86,86 @@ def view_event(event_id, slug=None):
             slug=event.slug))
 
     return render_template('events/view-event.html', event=event)
+
+
+def build_calendar(lang_code):
+    """Return upcoming events as an iCalendar document.
+
+    Events are considered upcoming the same way as on the index page.
+    The document is only rebuilt when events change, so an event stays
+    in the calendar until then even after it has passed. Calendar
+    clients keep past events anyway.
+    """
+    old = datetime.utcnow() - timedelta(hours=12)
+    events = (Event.query
+              .filter(Event.start_time > old, Event.published == True)
+              .order_by(Event.start_time.asc()))
+
+    calendar = [
+        ('VERSION', '2.0'),
+        ('PRODID', '-//Kongl. Teknologkören//teknologkoren.se//{}'
+         .format(lang_code.upper())),
+        ('CALSCALE', 'GREGORIAN'),
+        ('METHOD', 'PUBLISH'),
+        ('X-WR-CALNAME', 'Kongl. Teknologkören'),
+        ('X-WR-CALDESC', gettext('Upcoming concerts')),
+        ('REFRESH-INTERVAL;VALUE=DURATION', 'PT6H'),
+        ('X-PUBLISHED-TTL', 'PT6H'),
+    ]
+
+    vevents = []
+    for event in events:
+        content = getattr(event, 'content_{}'.format(lang_code)) or \
+            event.content_sv
+        vevents.append([
+            ('UID', 'event-{}@{}'.format(event.id, app.config['SERVER_NAME'])),
+            ('DTSTAMP', ical.format_datetime(event.timestamp)),
+            ('DTSTART', ical.format_datetime(event.start_time)),
+            ('DURATION', EVENT_DURATION),
+            ('SUMMARY', event.title),
+            ('LOCATION', event.location or ''),
+            ('DESCRIPTION', ical.markdown_to_text(content or '')),
+            ('URL', url_for('.view_event', event_id=event.id,
+                            slug=event.slug, lang_code=lang_code,
+                            _external=True)),
+        ])
+
+    return ical.serialize(calendar, vevents)
+
+
+calendar = CachedDocument(build_calendar,
+                          channels=['events'],
+                          lang_channels=['events'],
+                          mimetype='text/calendar')
+
+
+@mod.route('/kalender.ics')
+def ics():
+    """Upcoming events as an iCalendar feed to subscribe to.
+
+    Served from memory with an ETag, calendar clients poll often.
+    """
+    return calendar.response(g.lang_code)
+
+
+@mod.route('/biljetter/')
+def widgets():
+    """Billetto ticket widgets, from the server's cache.
+
+    Takes the Billetto event ids as one or more `id` parameters and
+    returns a json object mapping every id to the html of its widget,
+    or null if it could not be fetched or is not embedded in any
+    published post or event. See widgets.py.
+    """
+    ids = request.args.getlist('id')
+
+    if (not ids or len(ids) > MAX_WIDGETS or
+            not all(WIDGET_ID.match(widget_id) for widget_id in ids)):
+        abort(400)
+
+    known = embedded.ids()
+    response = dict.fromkeys(ids)
+    response.update(widget_cache.get_many(
+        [widget_id for widget_id in set(ids) if widget_id in known]))
+
+    return jsonify(response)
@@ -1,8 +1,12 @@
 from urllib.parse import urljoin
-from flask import Blueprint, render_template, request
+from flask import Blueprint, g, redirect, render_template, request, \
+        session, url_for
 from werkzeug.contrib.atom import AtomFeed
-from teknologkoren_se.models import Post, Event, Contact
-from teknologkoren_se.util import bp_url_processors
+from teknologkoren_se import app, projections
+from teknologkoren_se.cache import CachedDocument
+from teknologkoren_se.contacts import board
+from teknologkoren_se.models import Post
+from teknologkoren_se.util import bp_url_processors, is_safe_url
 
 
 mod = Blueprint('general', __name__, url_prefix='/<any(sv, en):lang_code>')
@@ -10,6 +14,24 @@ mod = Blueprint('general', __name__, url_prefix='/<any(sv, en):lang_code>')
 bp_url_processors(mod)
 
 
+@mod.route('/sprak/')
+def set_lang():
+    """Switch to the language in the url and remember it.
+
+    The language links go through here, to the page in `next`. The
+    language is kept in the session for paths without a lang code,
+    e.g. /. Only this response sets the cookie, so that the pages stay
+    cacheable.
+    """
+    session['lang_code'] = g.lang_code
+
+    target = request.args.get('next')
+    if not target or not is_safe_url(target):
+        target = url_for('blog.index')
+
+    return redirect(target)
+
+
 @mod.route('/om-oss/')
 def about():
     """Show about page."""
@@ -32,12 +54,11 @@ def sing():
 def contact():
     """Show contact page.
 
-    Order of board members and their email addresses are hard coded.
-    The template iterates over the list of tags and gets the user from
-    the generated dict to display them in the same order every time.
+    Contacts are ordered by weight, the chairman is picked from the
+    same cached list.
     """
-    contacts = Contact.query.order_by(Contact.weight.asc()).all()
-    ordf = Contact.query.filter_by(title='Ordförande').first()
+    contacts = board.all()
+    ordf = board.chairman()
 
     return render_template('general/contact.html',
                            contacts=contacts,
@@ -46,34 +67,45 @@ def contact():
 
 @mod.route('/lucia/')
 def lucia():
-    ordf = Contact.query.filter_by(title='Ordförande').first()
+    ordf = board.chairman()
 
     return render_template('general/lucia.html',
                            ordf=ordf)
 
 
-@mod.route('/feed/')
-def atom_feed():
-    """Generate and return rss-feed."""
-    feed = AtomFeed("Teknologkören", feed_url=request.url,
-                    url=request.url_root)
+def build_feed(lang_code):
+    """Return the latest posts and events as an Atom feed."""
+    links = [{'href': hub, 'rel': 'hub'} for hub in app.config['WEBSUB_HUBS']]
+    feed = AtomFeed("Teknologkören",
+                    feed_url=url_for('.atom_feed', lang_code=lang_code,
+                                     _external=True),
+                    url=request.url_root,
+                    links=links)
 
-    posts = (Post.query
-             .filter_by(published=True)
-             .order_by(Post.timestamp.desc())
-             .limit(15))
-
-    for post in posts:
-        if isinstance(post, Event):
+    for post in projections.feed_entries(lang_code, 15):
+        if post.type == 'event':
             path_base = "konserter/"
         else:
             path_base = "blog/"
 
         feed.add(post.title,
-                 post.content_to_html(post.content),
+                 Post.content_to_html(post.content),
                  content_type='html',
-                 url=urljoin(request.url_root, path_base+post.url),
+                 url=urljoin(request.url_root, '{}{}/{}/'.format(
+                     path_base, post.id, post.slug)),
                  updated=post.timestamp
                  )
 
-    return feed.get_response()
+    return feed.to_string()
+
+
+feeds = CachedDocument(build_feed,
+                       channels=['posts', 'events'],
+                       lang_channels=['posts', 'events'],
+                       mimetype='application/atom+xml')
+
+
+@mod.route('/feed/')
+def atom_feed():
+    """Return the cached Atom feed."""
+    return feeds.response(g.lang_code)
@@ -0,0 +1,43 @@
+import os
+from flask import abort, Blueprint, redirect, request, safe_join, send_file
+from teknologkoren_se import app, images
+from teknologkoren_se.image_cache import DerivativeCache, Image
+
+mod = Blueprint('resize', __name__)
+
+derivatives = DerivativeCache(app.config['IMAGE_CACHE_DIR'],
+                              app.config['IMAGE_CACHE_SIZE'],
+                              app.config['IMAGE_JPEG_QUALITY'])
+
+
+def resized(directory, width, filename):
+    """Return the image `filename` in `directory` resized to `width`.
+
+    Only the widths in IMAGE_WIDTHS are made, anything else is a 404,
+    so that the cache cannot be filled with arbitrary sizes.
+    """
+    if width not in app.config['IMAGE_WIDTHS']:
+        abort(404)
+
+    source = safe_join(directory, filename)
+    if not os.path.isfile(source):
+        abort(404)
+
+    if Image is None:
+        # Pillow is not installed, e.g. in development.
+        return redirect(request.path.replace('/img{}/'.format(width), '/'))
+
+    path = derivatives.get(source, request.path, width)
+    return send_file(path, conditional=True)
+
+
+@mod.route('/static/images/img<int:width>/<filename>')
+def static_image(width, filename):
+    """Resize an image of the site itself, in static/images."""
+    return resized(os.path.join(app.static_folder, 'images'), width, filename)
+
+
+@mod.route('/static/uploads/images/img<int:width>/<filename>')
+def uploaded_image(width, filename):
+    """Resize an image uploaded through the api."""
+    return resized(images.config.destination, width, filename)
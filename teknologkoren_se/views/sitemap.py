@@ -0,0 +1,126 @@
+from flask import Blueprint, url_for
+from markupsafe import escape
+from teknologkoren_se import projections
+from teknologkoren_se.cache import CachedDocument
+
+mod = Blueprint('sitemap', __name__)
+
+LANGS = ('sv', 'en')
+
+# Pages that are not posts or events, with their view arguments.
+PAGES = [
+    ('blog.index', {}),
+    ('events.index', {}),
+    ('events.archive', {}),
+    ('general.about', {}),
+    ('general.hire', {}),
+    ('general.sing', {}),
+    ('general.contact', {}),
+    ('general.lucia', {}),
+]
+
+SITEMAPS = ('pages', 'posts', 'events')
+
+
+def url_entries(endpoint, view_args, lastmod=None):
+    """Return <url> elements for a page in all languages.
+
+    Every language version links to all versions of the page with
+    hreflang alternates, as crawlers expect.
+    """
+    urls = {lang: url_for(endpoint, lang_code=lang, _external=True,
+                          **view_args)
+            for lang in LANGS}
+
+    alternates = ''.join(
+        '<xhtml:link rel="alternate" hreflang="{}" href="{}"/>'
+        .format(lang, escape(url)) for lang, url in urls.items())
+
+    if lastmod:
+        lastmod = '<lastmod>{}</lastmod>'.format(lastmod.strftime('%Y-%m-%d'))
+    else:
+        lastmod = ''
+
+    return ''.join('<url><loc>{}</loc>{}{}</url>\n'
+                   .format(escape(url), lastmod, alternates)
+                   for url in urls.values())
+
+
+def urlset(entries):
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+            'xmlns:xhtml="http://www.w3.org/1999/xhtml">\n'
+            '{}</urlset>\n'.format(''.join(entries)))
+
+
+def build_sitemaps(name):
+    """Build the sitemap index and all sitemaps.
+
+    All published posts and events come from a single query that only
+    selects the columns needed for their urls, see projections.py.
+    """
+    rows = projections.sitemap_entries()
+
+    entries = {'posts': [], 'events': []}
+    lastmods = {}
+
+    for post_id, post_type, slug, lastmod in rows:
+        if post_type == 'event':
+            sitemap = 'events'
+            entry = url_entries('events.view_event',
+                                {'event_id': post_id, 'slug': slug},
+                                lastmod)
+        else:
+            sitemap = 'posts'
+            entry = url_entries('blog.view_post',
+                                {'post_id': post_id, 'slug': slug},
+                                lastmod)
+
+        entries[sitemap].append(entry)
+        if lastmod and (sitemap not in lastmods or
+                        lastmod > lastmods[sitemap]):
+            lastmods[sitemap] = lastmod
+
+    entries['pages'] = [url_entries(endpoint, view_args)
+                        for endpoint, view_args in PAGES]
+
+    documents = {name: urlset(entries[name]) for name in SITEMAPS}
+
+    index_entries = []
+    for name in SITEMAPS:
+        lastmod = lastmods.get(name)
+        index_entries.append(
+            '<sitemap><loc>{}</loc>{}</sitemap>\n'.format(
+                escape(url_for('.sitemap', name=name, _external=True)),
+                '<lastmod>{}</lastmod>'.format(lastmod.strftime('%Y-%m-%d'))
+                if lastmod else ''))
+
+    documents['index'] = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        '{}</sitemapindex>\n'.format(''.join(index_entries)))
+
+    return documents
+
+
+# The sitemaps have the date of the last edit, so edits of only one
+# language (e.g. posts-sv) change them too.
+sitemaps = CachedDocument(build_sitemaps,
+                          channels=['posts', 'events', 'posts-sv',
+                                    'posts-en', 'events-sv', 'events-en'],
+                          mimetype='application/xml')
+
+
+@mod.route('/sitemap.xml')
+def index():
+    """Sitemap index, pointing to the sitemap of every type of page.
+
+    Lets crawlers find every post and event without walking the
+    paginated overview and archive pages.
+    """
+    return sitemaps.response('index')
+
+
+@mod.route('/sitemap-<any(pages, posts, events):name>.xml')
+def sitemap(name):
+    return sitemaps.response(name)
@@ -0,0 +1,106 @@
+"""Warm the caches of this process by requesting the most visited pages.
+
+Requests go through the WSGI app in-process, so they fill the same
+caches a visitor would: compiled templates, cached documents such as
+the feeds and sitemaps, and SQLite's page cache. Run after a deploy
+with `python manage.py warm`, and after writes of posts and events
+(see publish.py) unless CACHE_WARM_AFTER_WRITES is off. Only the
+worker that made the write is warmed after it, the other workers are
+not asked.
+"""
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from flask import url_for
+from teknologkoren_se import app
+from teknologkoren_se.database import PRIMARY_ENVIRON_KEY
+from teknologkoren_se.models import Event, Post
+
+LANGS = ('sv', 'en')
+
+WarmResult = namedtuple('WarmResult', 'path status seconds')
+
+
+def pages_to_warm(latest=None):
+    """Return the paths to warm, in order of importance.
+
+    For each language: the first (up to) three overview pages, upcoming
+    events, the `latest` newest posts and events, the feed and the
+    contact page. Last, the sitemap index, which builds all sitemaps.
+    """
+    if latest is None:
+        latest = app.config['CACHE_WARM_LATEST']
+
+    published = Post.query.filter_by(published=True)
+    newest = published.order_by(Post.timestamp.desc()).limit(latest).all()
+    # Five posts per overview page, see blog.index
+    overview_pages = min(3, max(1, -(-published.count() // 5)))
+
+    paths = []
+    with app.test_request_context():
+        for lang_code in LANGS:
+            paths.extend(url_for('blog.index', lang_code=lang_code, page=page)
+                         for page in range(1, overview_pages + 1))
+            paths.append(url_for('events.index', lang_code=lang_code))
+
+            for post in newest:
+                if isinstance(post, Event):
+                    paths.append(url_for('events.view_event',
+                                         lang_code=lang_code,
+                                         event_id=post.id,
+                                         slug=post.slug))
+                else:
+                    paths.append(url_for('blog.view_post',
+                                         lang_code=lang_code,
+                                         post_id=post.id,
+                                         slug=post.slug))
+
+            paths.append(url_for('general.atom_feed', lang_code=lang_code))
+            paths.append(url_for('general.contact', lang_code=lang_code))
+
+        paths.append(url_for('sitemap.index'))
+
+    return paths
+
+
+def warm(paths=None, concurrency=None):
+    """Request `paths` with at most `concurrency` requests at a time.
+
+    Returns a list of WarmResult, in the order of `paths`.
+    """
+    if paths is None:
+        paths = pages_to_warm()
+    if concurrency is None:
+        concurrency = app.config['CACHE_WARM_CONCURRENCY']
+
+    def fetch(path):
+        start = time.perf_counter()
+        with app.test_client() as client:
+            # Right after a write, a replica might not have it yet.
+            response = client.get(
+                path, environ_base={PRIMARY_ENVIRON_KEY: True})
+            # Read streamed responses to the end, or they are not
+            # rendered.
+            response.get_data()
+        return WarmResult(path, response.status_code,
+                          time.perf_counter() - start)
+
+    if concurrency == 1:
+        return [fetch(path) for path in paths]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(fetch, paths))
+
+
+def warm_after_write():
+    """Task warming the caches after a write, see publish.py."""
+    start = time.perf_counter()
+    results = warm()
+    failed = [result for result in results if result.status != 200]
+
+    app.logger.info('Warmed %d pages in %.2f s', len(results),
+                    time.perf_counter() - start)
+    if failed:
+        app.logger.warning('Warming failed for %s', ', '.join(
+            '{} ({})'.format(result.path, result.status)
+            for result in failed))
@@ -0,0 +1,209 @@
+"""Billetto ticket widgets, fetched by the server and cached.
+
+Posts and events embed Billetto's ticket widget with an element with
+the id `billetto_widget_<Billetto event id>`. Instead of every visitor
+fetching every widget from Billetto, init_billetto_widgets.js asks
+events.widgets for the widgets in view, which serves them from here.
+Only widgets embedded in published posts and events are fetched, any
+other id is unavailable.
+
+A widget is fetched once and kept for WIDGET_TTL seconds. After that
+it is still served, and refreshed in the background (see tasks.py),
+until it is WIDGET_MAX_STALE seconds old, when requests wait for a new
+one. If Billetto cannot be reached, the old widget is served for as
+long as there is one, and Billetto is not asked again for that widget
+until WIDGET_ERROR_TTL seconds later.
+"""
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import or_
+from teknologkoren_se import app
+from teknologkoren_se.cache import bus, SingleFlight
+from teknologkoren_se.database import read_from_primary
+from teknologkoren_se.models import Post
+from teknologkoren_se.tasks import tasks
+
+# Billetto event ids are numbers, optionally with a slug before them,
+# e.g. teknologkoren-julkonsert-biljetter-123456.
+WIDGET_ID = re.compile(r'^[A-Za-z0-9_-]{1,100}$')
+
+EMBEDDED_WIDGET = re.compile(r'billetto_widget_([A-Za-z0-9_-]{1,100})')
+
+
+def fetch_from_billetto(widget_id):
+    """Return the html of a widget, from BILLETTO_WIDGET_URL."""
+    url = app.config['BILLETTO_WIDGET_URL'].format(
+        urllib.parse.quote(widget_id))
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.read().decode('utf-8')
+
+
+class EmbeddedWidgets:
+    """The ids of the widgets embedded in published posts and events.
+
+    Found with a single query and kept until posts or events change.
+    """
+    def __init__(self):
+        self._ids = None
+        # Incremented by clear(), ids found while it was cleared might
+        # be stale and are not kept.
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def ids(self):
+        ids = self._ids
+        if ids is not None:
+            return ids
+
+        generation = self._generation
+        columns = (Post.content_sv, Post.content_en,
+                   Post.readmore_sv, Post.readmore_en)
+        rows = (Post.query
+                .with_entities(*columns)
+                .filter(Post.published == True)
+                .filter(or_(*(column.contains('billetto_widget_')
+                              for column in columns))))
+
+        with read_from_primary():
+            ids = frozenset(widget_id
+                            for row in rows
+                            for text in row if text
+                            for widget_id in EMBEDDED_WIDGET.findall(text))
+
+        with self._lock:
+            if self._generation == generation:
+                self._ids = ids
+        return ids
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._ids = None
+
+
+embedded = EmbeddedWidgets()
+
+for channel in ('posts', 'events', 'posts-sv', 'posts-en', 'events-sv',
+                'events-en'):
+    bus.subscribe(channel, embedded.clear)
+
+
+class WidgetCache:
+    """Widgets by Billetto event id, the WIDGET_CACHE_SIZE most
+    recently used of them.
+
+    `fetch` is called with an id and returns the html of the widget,
+    or raises an exception. By default it fetches it from Billetto,
+    tests can use any stand-in.
+
+    Every widget is kept as (html, fresh until, stale until), html is
+    None if it could not be fetched.
+    """
+    def __init__(self, fetch=None):
+        self.fetch = fetch or fetch_from_billetto
+        self._widgets = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+
+    def get(self, widget_id):
+        """Return the html of a widget, or None if it is unavailable."""
+        return self.get_many([widget_id])[widget_id]
+
+    def get_many(self, widget_ids):
+        """Return a dict mapping widget ids to their html, or None.
+
+        Widgets that have to be fetched before they are served are
+        fetched concurrently.
+        """
+        widgets = {}
+        missing = []
+
+        for widget_id in widget_ids:
+            found, html = self._lookup(widget_id)
+            if found:
+                widgets[widget_id] = html
+            else:
+                missing.append(widget_id)
+
+        if len(missing) == 1:
+            widgets[missing[0]] = self._fetch_once(missing[0])
+        elif missing:
+            with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+                widgets.update(zip(missing,
+                                   pool.map(self._fetch_once, missing)))
+
+        return widgets
+
+    def _lookup(self, widget_id):
+        """Return whether the widget can be served without waiting for
+        Billetto, and its html.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._widgets.get(widget_id)
+            if cached is None:
+                return False, None
+
+            self._widgets.move_to_end(widget_id)
+            html, fresh_until, stale_until = cached
+
+            if now < fresh_until:
+                return True, html
+
+            if now < stale_until:
+                # Not refreshed again by other requests until then,
+                # also if the task is dropped.
+                self._widgets[widget_id] = (
+                    html, now + app.config['WIDGET_ERROR_TTL'], stale_until)
+                refresh = True
+            else:
+                refresh = False
+
+        if refresh:
+            tasks.submit(self._fetch, widget_id)
+            return True, html
+
+        return False, None
+
+    def _fetch_once(self, widget_id):
+        return self._flights.do(widget_id, lambda: self._fetch(widget_id))
+
+    def _fetch(self, widget_id):
+        try:
+            html = self.fetch(widget_id)
+        except Exception:
+            app.logger.warning('Fetching widget %s failed', widget_id,
+                               exc_info=True)
+            html = None
+
+        now = time.monotonic()
+
+        with self._lock:
+            if html is not None:
+                self._widgets[widget_id] = (
+                    html, now + app.config['WIDGET_TTL'],
+                    now + app.config['WIDGET_MAX_STALE'])
+            else:
+                # Keep serving the old widget, if any, and do not ask
+                # Billetto again for a while.
+                old, _, stale_until = self._widgets.get(
+                    widget_id, (None, None, now))
+                retry = now + app.config['WIDGET_ERROR_TTL']
+                html = old
+                self._widgets[widget_id] = (old, retry,
+                                            max(stale_until, retry))
+
+            self._widgets.move_to_end(widget_id)
+            while len(self._widgets) > app.config['WIDGET_CACHE_SIZE']:
+                self._widgets.popitem(last=False)
+
+        return html
+
+
+widgets = WidgetCache()